@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import NamedTuple
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:  # пакет Brotli из requirements.txt; без него отдаём только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Ссылки на локальные файлы в index.html: src="app.js", href="/static/styles.css"
+ASSET_REFERENCE = re.compile(r'(src|href)="(?:/?static/)?([^"/:?#]+)"')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'  # можно хранить, но перед использованием спросить ETag
+
+# Сжатые варианты в порядке предпочтения
+ENCODINGS = ('br', 'gzip')
+
+
+class Asset(NamedTuple):
+    content_type: str
+    variants: dict  # Content-Encoding ('identity', 'gzip', 'br') -> тело
+    etag: str       # хэш содержимого, у сжатых вариантов - с суффиксом кодировки
+    cache_control: str
+
+
+def _accepted(header: str):
+    """Кодировки из Accept-Encoding, кроме явно запрещённых q=0"""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class AssetBundle:
+    """Файлы Mini App, подготовленные при запуске и отдаваемые из памяти.
+
+    Каждый файл получает имя с хэшем содержимого (app.3f2a9c1b07de.js)
+    и кэшируется браузером навсегда; index.html переписывается на эти имена
+    и проверяется по ETag при каждом открытии. Старые имена без хэша
+    по-прежнему отдаются, но с проверкой ETag.
+    """
+
+    def __init__(self, directory='mini_app', prefix='/static/', index='index.html'):
+        self.directory = directory
+        self.prefix = prefix
+        self.index_name = index
+        self.assets = {}  # имя в URL после prefix -> Asset
+        self.urls = {}    # исходное имя -> URL с хэшем
+        self.index = None
+
+    def build(self):
+        if brotli is None:
+            logger.warning("Пакет brotli не установлен: файлы Mini App сжимаются только gzip")
+        assets, urls = {}, {}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name == self.index_name or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            digest = hashlib.sha256(data).hexdigest()
+            stem, ext = os.path.splitext(name)
+            fingerprinted = f"{stem}.{digest[:12]}{ext}"
+            asset = self._prepare(name, data, digest)
+            assets[fingerprinted] = asset._replace(cache_control=IMMUTABLE)
+            assets[name] = asset
+            urls[name] = self.prefix + fingerprinted
+
+        with open(os.path.join(self.directory, self.index_name), encoding='utf-8') as f:
+            html = ASSET_REFERENCE.sub(
+                lambda m: f'{m[1]}="{urls[m[2]]}"' if m[2] in urls else m[0],
+                f.read()
+            ).encode('utf-8')
+
+        self.assets, self.urls = assets, urls
+        self.index = self._prepare(self.index_name, html, hashlib.sha256(html).hexdigest())
+        return self
+
+    def _prepare(self, name: str, data: bytes, digest: str):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        variants = {'identity': data}
+        if content_type.startswith('text/') or content_type.endswith(('javascript', 'json', 'svg+xml')):
+            compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(data, quality=11)
+            # Сжатие маленьких файлов может дать больше исходного
+            variants.update((coding, body) for coding, body in compressed.items() if len(body) < len(data))
+        if content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+        return Asset(content_type, variants, digest[:16], REVALIDATE)
+
+    def response(self, request, asset: Asset):
+        """Ответ с подходящим сжатием; 304, если у клиента уже есть этот вариант"""
+        accepted = _accepted(request.headers.get('Accept-Encoding', ''))
+        coding = next((c for c in ENCODINGS if c in asset.variants and c in accepted), 'identity')
+        etag = f'"{asset.etag}"' if coding == 'identity' else f'"{asset.etag}-{coding}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': asset.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(',')) or if_none_match == '*':
+            return web.Response(status=304, headers=headers)
+
+        if coding != 'identity':
+            headers['Content-Encoding'] = coding
+        return web.Response(body=asset.variants[coding], headers=headers,
+                            content_type=asset.content_type.split(';')[0],
+                            charset='utf-8' if 'charset' in asset.content_type else None)
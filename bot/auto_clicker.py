@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from sqlalchemy import select, update, insert
+
+from database import AsyncSessionLocal
+from models import User, Transaction
+from notifications import notifier
+from stats import credit_values, LEDGER_COLUMNS
+from ledger_writer import ledger_writer, write_through
+from config import (AUTO_CLICKER_REWARD, AUTO_CLICKER_INTERVAL, AUTO_CLICKER_TICK,
+                    AUTO_CLICKER_NOTIFY, AUTO_CLICKER_RESYNC)
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на размер IN (...) в одном запросе
+CHUNK_SIZE = 500
+
+
+class AutoClickerScheduler:
+    """Планировщик автокликеров на колесе таймеров.
+
+    Колесо разбито на interval / tick слотов. Каждый тик обрабатывается один
+    слот: всем пользователям в нём начисление делается одним UPDATE и одной
+    многострочной вставкой в transactions. Пользователь остаётся в своём слоте
+    и снова срабатывает через полный оборот колеса.
+    """
+
+    def __init__(self, reward=AUTO_CLICKER_REWARD, interval=AUTO_CLICKER_INTERVAL,
+                 tick=AUTO_CLICKER_TICK, notify=AUTO_CLICKER_NOTIFY, resync=AUTO_CLICKER_RESYNC):
+        self.reward = reward
+        self.tick = tick
+        self.notify = notify
+        self.resync = resync
+        self.slots_count = max(1, round(interval / tick))
+
+        self._wheel = [set() for _ in range(self.slots_count)]
+        self._slot_of = {}  # user_id -> номер слота
+        self._cursor = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def add(self, user_id: int):
+        """Ставит пользователя на колесо: первое начисление через полный оборот"""
+        if user_id in self._slot_of:
+            return
+        self._place(user_id, self._cursor)
+
+    def remove(self, user_id: int):
+        slot = self._slot_of.pop(user_id, None)
+        if slot is not None:
+            self._wheel[slot].discard(user_id)
+
+    def _place(self, user_id: int, slot: int):
+        self._wheel[slot].add(user_id)
+        self._slot_of[user_id] = slot
+
+    async def load(self):
+        """Ставит на колесо активных пользователей из таблицы users, возвращает число новых"""
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(User.user_id).where(User.auto_clicker_active == True)
+            )
+            user_ids = result.scalars().all()
+
+        # Раскладываем по слотам равномерно, чтобы не начислять всем в один тик
+        added = 0
+        for user_id in user_ids:
+            if user_id not in self._slot_of:
+                self._place(user_id, user_id % self.slots_count)
+                added += 1
+        return added
+
+    async def _credit(self, user_ids):
+        """Начисляет награду активным пользователям, возвращает [(user_id, balance)]"""
+        users = User.__table__
+
+        async def credit(session):
+            credited = []
+            for i in range(0, len(user_ids), CHUNK_SIZE):
+                chunk = user_ids[i:i + CHUNK_SIZE]
+                result = await session.execute(
+                    update(users)
+                    .where(users.c.user_id.in_(chunk), users.c.auto_clicker_active == True)
+                    .values(**credit_values(self.reward))
+                    .returning(*LEDGER_COLUMNS)
+                )
+                credited.extend(result.all())
+
+            if credited:
+                await session.execute(insert(Transaction), [
+                    {
+                        'from_user_id': 0,  # Система
+                        'to_user_id': user_id,
+                        'amount': self.reward,
+                        'type': 'click',
+                        'description': "Автокликер"
+                    }
+                    for user_id, *_ in credited
+                ])
+            return credited
+
+        credited = await ledger_writer.submit(credit, on_commit=write_through)
+        return [(row.user_id, row.balance) for row in credited]
+
+    def _notify(self, credited):
+        # Неотправленные уведомления одного пользователя сливаются в одно
+        for user_id, balance in credited:
+            notifier.send_balance(user_id, self.reward, balance)
+
+    async def _process_slot(self, slot: int):
+        due = list(self._wheel[slot])
+        if not due:
+            return
+
+        credited = await self._credit(due)
+
+        # Снимаем с колеса тех, у кого автокликер выключили или кого нет в БД
+        active = {user_id for user_id, _ in credited}
+        for user_id in due:
+            if user_id not in active and self._slot_of.get(user_id) == slot:
+                self.remove(user_id)
+
+        if self.notify and credited:
+            self._notify(credited)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            next_tick += self.tick
+
+            self._cursor = (self._cursor + 1) % self.slots_count
+            try:
+                if self.resync and self._cursor == 0:
+                    # Автокликеры, включённые на других воркерах
+                    await self.load()
+                await self._process_slot(self._cursor)
+            except Exception:
+                logger.exception("Автокликер: ошибка начисления в слоте %d", self._cursor)
+
+    async def start(self):
+        """Загружает активных пользователей и запускает колесо"""
+        logger.info("Автокликер: восстановлено %d пользователей", await self.load())
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+auto_clicker = AutoClickerScheduler()
@@ -0,0 +1,125 @@
+import time
+from collections import OrderedDict
+
+from models import User
+from config import BALANCE_CACHE_SIZE, BALANCE_CACHE_TTL
+
+# Поля строки users, которые держим в памяти
+CACHED_FIELDS = (
+    'user_id', 'username', 'first_name', 'balance', 'auto_clicker_active', 'registered_at',
+    'tx_count', 'total_in', 'total_out', 'last_activity_at'
+)
+
+
+class UserSnapshot:
+    """Копия строки users; атрибуты совпадают с моделью User"""
+    __slots__ = CACHED_FIELDS + ('expires_at',)
+
+    def __init__(self, **fields):
+        for name in CACHED_FIELDS:
+            setattr(self, name, fields.get(name))
+
+
+class BalanceCache:
+    """LRU-кэш пользователей и балансов с записью насквозь.
+
+    Все пути, меняющие users.balance (клики, переводы, автокликер), после
+    коммита кладут сюда новые значения из RETURNING.
+    Чтение, начатое до такой записи, результат в кэш не кладёт - иначе
+    оно могло бы затереть свежий баланс старым.
+
+    Записи других процессов сюда не попадают, поэтому при нескольких
+    воркерах у записи есть срок жизни ttl.
+    """
+
+    def __init__(self, size=BALANCE_CACHE_SIZE, ttl=BALANCE_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> UserSnapshot
+        self._seq = 0  # номер последней записи
+        self._written = OrderedDict()  # user_id -> номер его последней записи
+        self._forgotten_seq = 0  # максимальный номер записи, вытесненной из _written
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id: int):
+        snapshot = self._entries.get(user_id)
+        if snapshot is not None and self.ttl and snapshot.expires_at <= time.monotonic():
+            del self._entries[user_id]
+            snapshot = None
+        if snapshot is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return snapshot
+
+    async def load(self, session, user_id: int):
+        """Пользователь из кэша, а при промахе - из БД (None, если его нет)"""
+        snapshot = self.get(user_id)
+        if snapshot is not None:
+            return snapshot
+
+        started_at = self._seq
+        user = await session.get(User, user_id)
+        if user is None:
+            return None
+
+        snapshot = UserSnapshot(**{name: getattr(user, name) for name in CACHED_FIELDS})
+        if not self._written_since(user_id, started_at):
+            self._put(user_id, snapshot)
+        return snapshot
+
+    def apply(self, row):
+        """Запись насквозь: строка RETURNING с колонками stats.LEDGER_COLUMNS"""
+        self._mark_written(row.user_id)
+        snapshot = self._entries.get(row.user_id)
+        if snapshot is not None:
+            for name, value in row._mapping.items():
+                setattr(snapshot, name, value)
+            snapshot.expires_at = time.monotonic() + self.ttl
+
+    def set_auto_clicker(self, user_id: int, active: bool):
+        self._mark_written(user_id)
+        snapshot = self._entries.get(user_id)
+        if snapshot is not None:
+            snapshot.auto_clicker_active = active
+
+    def invalidate(self, user_id: int):
+        self._mark_written(user_id)
+        self._entries.pop(user_id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0
+        }
+
+    def _put(self, user_id: int, snapshot: UserSnapshot):
+        if self.size <= 0:
+            return
+        snapshot.expires_at = time.monotonic() + self.ttl
+        self._entries[user_id] = snapshot
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def _mark_written(self, user_id: int):
+        self._seq += 1
+        self._written[user_id] = self._seq
+        self._written.move_to_end(user_id)
+        while len(self._written) > max(self.size, 1024):
+            _, seq = self._written.popitem(last=False)
+            self._forgotten_seq = max(self._forgotten_seq, seq)
+
+    def _written_since(self, user_id: int, seq: int):
+        return self._written.get(user_id, 0) > seq or self._forgotten_seq > seq
+
+
+balance_cache = BalanceCache()
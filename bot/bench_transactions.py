@@ -0,0 +1,82 @@
+"""Бенчмарк истории транзакций: число SQL-запросов не зависит от размера страницы.
+
+Запуск: python bot/bench_transactions.py
+Работает на временной базе, bank.db не трогает.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import Base, AsyncSessionLocal
+from models import User, Transaction
+from web_app_server import WebAppServer
+
+USERS = 200
+PAGE_SIZES = (5, 20, 100)
+USER_ID = 1
+
+
+async def seed():
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await session.execute(insert(User), [
+                {'user_id': i, 'username': f'user{i}', 'first_name': f'User {i}', 'balance': 1000}
+                for i in range(1, USERS + 1)
+            ])
+            # Переводы с разными собеседниками вперемешку с системными начислениями
+            rows = []
+            for i in range(2, USERS + 1):
+                rows.append({'from_user_id': USER_ID, 'to_user_id': i, 'amount': 1, 'type': 'transfer'})
+                rows.append({'from_user_id': i, 'to_user_id': USER_ID, 'amount': 1, 'type': 'transfer'})
+                rows.append({'from_user_id': 0, 'to_user_id': USER_ID, 'amount': 10, 'type': 'click'})
+            await session.execute(insert(Transaction), rows)
+
+
+async def main():
+    # Подменяем базу у фабрики сессий на временную
+    path = os.path.join(tempfile.mkdtemp(prefix="bank_bench_"), "bank.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    AsyncSessionLocal.configure(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await seed()
+
+    queries = []
+    event.listen(engine.sync_engine, "before_cursor_execute",
+                 lambda *args: queries.append(args[2]))
+
+    server = WebAppServer()
+    modes = {
+        'offset': lambda session, limit: server.get_transactions_page(session, USER_ID, 1, limit),
+        'cursor': lambda session, limit: server.get_transactions_before(session, USER_ID, limit),
+    }
+
+    failed = False
+    for mode, fetch in modes.items():
+        counts = {}
+        for limit in PAGE_SIZES:
+            async with AsyncSessionLocal() as session:
+                queries.clear()
+                started = time.perf_counter()
+                page = await fetch(session, limit)
+                elapsed = (time.perf_counter() - started) * 1000
+
+            counts[limit] = len(queries)
+            print(f"{mode:<6} limit={limit:<4} rows={len(page['transactions']):<4} "
+                  f"queries={len(queries)} time={elapsed:.1f}ms")
+
+        if len(set(counts.values())) != 1:
+            print(f"FAIL: в режиме {mode} число запросов зависит от размера страницы")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+    print("OK: число запросов на страницу не зависит от limit")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,363 @@
+"""Нагрузочный бенчмарк хэндлеров бота и API Mini App.
+
+Заполняет временную базу (или копию существующей) пользователями и историей,
+прогоняет операции через handlers.router с поддельным Bot и через WebAppServer
+с тестовым клиентом aiohttp и подписанным initData. Для каждой операции
+печатает p50/p95/p99, операций в секунду и SQL-запросов на операцию,
+результат пишет в JSON. С --baseline сравнивает с прошлым прогоном и
+завершается с кодом 1, если p95 вырос больше допуска или стало больше запросов.
+
+Операции: click, profile, transfer (диалог из трёх сообщений), get_balance, get_transactions.
+
+Запуск: python bot/benchmark.py [--users 1000] [--transactions 20000] [--ops 500]
+                                [--concurrency 20] [--copy-from bank.db]
+                                [--output benchmark.json] [--baseline old.json]
+bank.db не трогает: --copy-from работает с копией.
+"""
+import argparse
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextvars import ContextVar
+from urllib.parse import urlencode
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import event, insert, select, func
+
+import database
+from database import AsyncSessionLocal, create_engine_for, init_db
+from models import User, Transaction
+from config import BOT_TOKEN
+from handlers import router
+from middlewares import DbSessionMiddleware
+from rate_limit import BotRateLimitMiddleware
+from web_app_server import WebAppServer
+from click_aggregator import click_aggregator
+from ledger_writer import ledger_writer
+from notifications import notifier
+
+OPERATIONS = ('click', 'profile', 'transfer', 'get_balance', 'get_transactions')
+INITIAL_BALANCE = 1_000_000
+FAKE_TOKEN = "123456:BENCHMARK"  # Bot проверяет только формат токена
+
+# SQL-запросы текущей операции: у каждой корутины свой счётчик
+_queries = ContextVar('benchmark_queries', default=None)
+
+
+class FakeSession(BaseSession):
+    """Bot API без сети: на любой метод сразу отвечает успехом"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if method.__returning__ is Message:
+            return Message(
+                message_id=self.calls,
+                date=datetime.datetime.now(),
+                chat=Chat(id=getattr(method, 'chat_id', 0) or 0, type='private'),
+                text=getattr(method, 'text', None)
+            )
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def sign_init_data(user_id: int, bot_token=BOT_TOKEN):
+    """initData, подписанный так же, как его подписывает Telegram"""
+    data = {
+        'auth_date': str(int(time.time())),
+        'query_id': f'bench{user_id}',
+        'user': json.dumps({'id': user_id, 'first_name': f'User {user_id}'})
+    }
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(data.items()))
+    secret_key = hmac.new(b"WebAppData", (bot_token or "").encode(), hashlib.sha256).digest()
+    data['hash'] = hmac.new(secret_key, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def prepare_database(copy_from, users: int, transactions: int, rng):
+    """Временная база: пустая или копия copy_from, плюс users пользователей с историей"""
+    path = os.path.join(tempfile.mkdtemp(prefix="bank_benchmark_"), "bank.db")
+    if copy_from:
+        # backup копирует согласованный снимок даже из работающей базы
+        source, target = sqlite3.connect(copy_from), sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+
+    engine = create_engine_for(f"sqlite:///{path}")
+    database.engine = engine
+    AsyncSessionLocal.configure(bind=engine)
+    await init_db()
+
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            first_id = (await session.scalar(select(func.max(User.user_id))) or 0) + 1
+            user_ids = list(range(first_id, first_id + users))
+            await session.execute(insert(User), [
+                {'user_id': user_id, 'username': f'bench{user_id}', 'first_name': f'User {user_id}',
+                 'balance': INITIAL_BALANCE}
+                for user_id in user_ids
+            ])
+            rows = [
+                {'from_user_id': 0, 'to_user_id': user_id, 'amount': INITIAL_BALANCE, 'type': 'bonus'}
+                for user_id in user_ids
+            ]
+            for _ in range(transactions):
+                # Примерно как в жизни: в основном клики, иногда переводы
+                if rng.random() < 0.8:
+                    rows.append({'from_user_id': 0, 'to_user_id': rng.choice(user_ids), 'amount': 10,
+                                 'type': 'click', 'description': "Клик"})
+                else:
+                    sender, recipient = rng.sample(user_ids, 2)
+                    rows.append({'from_user_id': sender, 'to_user_id': recipient, 'amount': 1,
+                                 'type': 'transfer'})
+            for i in range(0, len(rows), 5000):
+                await session.execute(insert(Transaction), rows[i:i + 5000])
+
+    return engine, path, user_ids
+
+
+@web.middleware
+async def count_queries_middleware(request, handler):
+    """Сервер обрабатывает запрос в своей задаче - число запросов возвращаем заголовком"""
+    token = _queries.set([0])
+    try:
+        response = await handler(request)
+        response.headers['X-Benchmark-Queries'] = str(_queries.get()[0])
+        return response
+    finally:
+        _queries.reset(token)
+
+
+class Benchmark:
+    def __init__(self, user_ids, concurrency: int, seed: int):
+        self.user_ids = user_ids
+        self.concurrency = concurrency
+        self.seed = seed
+        self.update_id = 0
+
+        self.bot = Bot(FAKE_TOKEN, session=FakeSession())
+        self.dispatcher = Dispatcher()
+        self.dispatcher.update.outer_middleware(BotRateLimitMiddleware())
+        self.dispatcher.update.outer_middleware(DbSessionMiddleware(AsyncSessionLocal))
+        self.dispatcher.include_router(router)
+        self.server = WebAppServer()
+        self.server.app.middlewares.insert(0, count_queries_middleware)
+        self.client = None
+        self.init_data = {}
+
+    async def feed(self, user_id: int, text: str):
+        self.update_id += 1
+        await self.dispatcher.feed_update(self.bot, Update.model_validate({
+            'update_id': self.update_id,
+            'message': {
+                'message_id': self.update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}',
+                         'username': f'bench{user_id}'},
+                'text': text
+            }
+        }, context={'bot': self.bot}))
+
+    async def api(self, user_id: int, endpoint: str, data: dict):
+        init_data = self.init_data.get(user_id)
+        if init_data is None:
+            init_data = self.init_data[user_id] = sign_init_data(user_id)
+        async with self.client.post(f'/api/{endpoint}', json=data,
+                                    headers={'X-Telegram-Init-Data': init_data}) as response:
+            body = await response.json()
+            if response.status != 200 or not body.get('success'):
+                raise RuntimeError(f"{endpoint}: {response.status} {body}")
+            _queries.get()[0] += int(response.headers['X-Benchmark-Queries'])
+
+    async def run_operation(self, name: str, user_id: int, rng):
+        if name == 'click':
+            await self.feed(user_id, "🖱 Кликнуть +10₽")
+        elif name == 'profile':
+            await self.feed(user_id, "📊 Профиль")
+        elif name == 'transfer':
+            recipient = rng.choice(self.user_ids)
+            while recipient == user_id:
+                recipient = rng.choice(self.user_ids)
+            await self.feed(user_id, "💸 Перевести")
+            await self.feed(user_id, str(recipient))
+            await self.feed(user_id, "1")
+        elif name == 'get_balance':
+            await self.api(user_id, 'get_balance', {})
+        elif name == 'get_transactions':
+            await self.api(user_id, 'get_transactions', {'limit': 20})
+
+    async def measure(self, name: str, total: int, phase='measure'):
+        latencies, queries = [], []
+        # У каждой корутины свои пользователи: диалоги перевода одного пользователя не пересекаются
+        slices = [self.user_ids[i::self.concurrency] for i in range(self.concurrency)]
+        per_worker = [total // self.concurrency + (i < total % self.concurrency) for i in range(self.concurrency)]
+
+        async def worker(number, users, count):
+            # Своя последовательность у каждой корутины: выбор пользователей не зависит от планировщика
+            rng = random.Random(f"{self.seed}:{phase}:{name}:{number}")
+            for _ in range(count):
+                user_id = rng.choice(users)
+                token = _queries.set([0])
+                started = time.perf_counter()
+                await self.run_operation(name, user_id, rng)
+                latencies.append(time.perf_counter() - started)
+                queries.append(_queries.get()[0])
+                _queries.reset(token)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            worker(number, users, count)
+            for number, (users, count) in enumerate(zip(slices, per_worker)) if users
+        ))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'ops': len(latencies),
+            'ops_per_sec': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'queries_per_op': round(sum(queries) / len(queries), 2) if queries else 0.0
+        }
+
+    async def run(self, operations, total: int, warmup: int):
+        results = {}
+        async with TestClient(TestServer(self.server.app)) as self.client:
+            ledger_writer.start()
+            click_aggregator.start()
+            notifier.start(self.bot)
+            try:
+                for name in operations:
+                    # Прогрев заполняет кэши и пул соединений, его замеры отбрасываются
+                    if warmup:
+                        await self.measure(name, warmup, phase='warmup')
+                    results[name] = await self.measure(name, total)
+                    # Следующая операция не должна платить за накопленные клики этой
+                    await click_aggregator.flush()
+                    print(f"{name:<17} {results[name]['ops_per_sec']:>8} оп/с  "
+                          f"p50 {results[name]['p50_ms']:>7.2f}мс  p95 {results[name]['p95_ms']:>7.2f}мс  "
+                          f"p99 {results[name]['p99_ms']:>7.2f}мс  запросов {results[name]['queries_per_op']}")
+            finally:
+                await click_aggregator.stop()
+                await ledger_writer.stop()
+                await notifier.stop()
+                await self.bot.session.close()
+        return results
+
+
+def compare(results, baseline, tolerance: float):
+    """Регрессии относительно прошлого прогона: рост p95 больше допуска или больше запросов"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] if previous['p95_ms'] else 0.0
+        print(f"{name:<17} p95 {previous['p95_ms']:.2f} -> {current['p95_ms']:.2f}мс ({change:+.0%}), "
+              f"запросов {previous['queries_per_op']} -> {current['queries_per_op']}")
+        if change > tolerance:
+            regressions.append(f"{name}: p95 вырос на {change:.0%}")
+        if current['queries_per_op'] > previous['queries_per_op'] + 0.01:
+            regressions.append(f"{name}: запросов на операцию {previous['queries_per_op']} -> "
+                               f"{current['queries_per_op']}")
+    return regressions
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    engine, path, user_ids = await prepare_database(args.copy_from, args.users, args.transactions, rng)
+    print(f"База {path}: {len(user_ids)} пользователей, {args.transactions} транзакций")
+
+    def count_query(*_):
+        current = _queries.get()
+        if current is not None:
+            current[0] += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+
+    benchmark = Benchmark(user_ids, args.concurrency, args.seed)
+    results = await benchmark.run(args.operations, args.ops, args.warmup)
+    await engine.dispose()
+
+    report = {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'params': {
+            'users': args.users,
+            'transactions': args.transactions,
+            'ops': args.ops,
+            'warmup': args.warmup,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'copy_from': args.copy_from
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("РЕГРЕССИЯ:\n  " + "\n  ".join(regressions))
+            return 1
+        print("OK: регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=20000, help="строк истории при заполнении")
+    parser.add_argument('--ops', type=int, default=500, help="операций каждого вида")
+    parser.add_argument('--warmup', type=int, default=50, help="операций прогрева перед замером")
+    parser.add_argument('--concurrency', type=int, default=20, help="одновременных пользователей")
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument('--copy-from', help="начать с копии этой базы SQLite")
+    parser.add_argument('--seed', type=int, default=1, help="зерно случайных чисел для повторяемости")
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.3, help="допустимый рост p95 (0.3 = 30%%)")
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error("нужно хотя бы 2 пользователя")
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from sqlalchemy import update, insert, case
+
+from models import User, Transaction
+from stats import credit_values, LEDGER_COLUMNS
+from ledger_writer import ledger_writer, write_through
+from config import (CLICK_REWARD, CLICK_FLUSH_INTERVAL, CLICK_FLUSH_THRESHOLD,
+                    CLICK_AGGREGATE_LEDGER)
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на размер IN (...) и CASE в одном запросе
+CHUNK_SIZE = 500
+
+
+class ClickAggregator:
+    """Накопитель кликов: копит клики в памяти и пишет их в БД пачками"""
+
+    def __init__(self, reward=CLICK_REWARD, interval=CLICK_FLUSH_INTERVAL,
+                 threshold=CLICK_FLUSH_THRESHOLD, aggregate_ledger=CLICK_AGGREGATE_LEDGER):
+        self.reward = reward
+        self.interval = interval
+        self.threshold = threshold
+        self.aggregate_ledger = aggregate_ledger
+
+        self._pending = {}   # user_id -> количество кликов, ещё не отправленных в БД
+        self._inflight = {}  # user_id -> клики, которые сейчас записываются
+        self._pending_total = 0
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    def __len__(self):
+        return self._pending_total
+
+    def add(self, user_id: int) -> int:
+        """Регистрирует клик и возвращает сумму, ещё не записанную в БД"""
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        self._pending_total += 1
+        if self._pending_total >= self.threshold:
+            self._wakeup.set()
+        return self.pending_amount(user_id)
+
+    def pending_amount(self, user_id: int) -> int:
+        """Сумма кликов пользователя, которая ещё не видна в users.balance"""
+        clicks = self._pending.get(user_id, 0) + self._inflight.get(user_id, 0)
+        return clicks * self.reward
+
+    async def flush(self):
+        """Записывает все накопленные клики одной транзакцией"""
+        async with self._lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, {}
+            self._pending_total = 0
+            self._inflight = batch
+
+            try:
+                await self._write(batch)
+            except BaseException:
+                # _inflight пуст - коммит прошёл, а прервано только ожидание результата
+                if self._inflight:
+                    # Возвращаем клики в очередь, чтобы не потерять их
+                    logger.exception("Не удалось записать %d кликов", sum(batch.values()))
+                    for user_id, clicks in batch.items():
+                        self._pending[user_id] = self._pending.get(user_id, 0) + clicks
+                        self._pending_total += clicks
+                raise
+            finally:
+                self._inflight = {}
+
+    async def _write(self, batch):
+        users = User.__table__
+
+        if self.aggregate_ledger:
+            rows = [
+                {
+                    'from_user_id': 0,  # Система
+                    'to_user_id': user_id,
+                    'amount': clicks * self.reward,
+                    'type': 'click',
+                    'description': f"Клики ×{clicks}"
+                }
+                for user_id, clicks in batch.items()
+            ]
+        else:
+            rows = [
+                {
+                    'from_user_id': 0,  # Система
+                    'to_user_id': user_id,
+                    'amount': self.reward,
+                    'type': 'click',
+                    'description': "Клик"
+                }
+                for user_id, clicks in batch.items()
+                for _ in range(clicks)
+            ]
+
+        items = list(batch.items())
+
+        async def credit(session):
+            updated = []
+            for i in range(0, len(items), CHUNK_SIZE):
+                chunk = dict(items[i:i + CHUNK_SIZE])
+                amount = case({user_id: clicks * self.reward for user_id, clicks in chunk.items()},
+                              value=users.c.user_id)
+                # Сколько строк истории добавляется пользователю
+                count = 1 if self.aggregate_ledger else case(chunk, value=users.c.user_id)
+                result = await session.execute(
+                    update(users)
+                    .where(users.c.user_id.in_(chunk))
+                    .values(**credit_values(amount, count))
+                    .returning(*LEDGER_COLUMNS)
+                )
+                updated.extend(result.all())
+            await session.execute(insert(Transaction), rows)
+            return updated
+
+        def committed(updated):
+            # Клики уже в балансе, который write_through кладёт в кэш: в pending_amount
+            # их больше не считаем, иначе до возврата из submit они учтены дважды
+            self._inflight = {}
+            write_through(updated)
+
+        # Одна операция в общей транзакции с переводами и автокликером
+        await ledger_writer.submit(credit, on_commit=committed)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                # Клики уже возвращены в очередь, повторим на следующем тике
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновый сброс и записывает оставшиеся клики"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+
+
+click_aggregator = ClickAggregator()
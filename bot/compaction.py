@@ -0,0 +1,196 @@
+"""Сжатие истории: старые клики сворачиваются в дневные итоги.
+
+Строки type='click' за день до границы (LEDGER_COMPACT_AFTER_DAYS дней назад)
+заменяются одной строкой type='click_summary' на пользователя, исходные строки
+переносятся в transactions_archive. users.tx_count уменьшается на число
+свёрнутых строк минус одну - счётчик совпадает с видимой историей и с
+stats.rebuild_user_stats(). Каждый день обрабатывается отдельной
+транзакцией; перед коммитом проверяется, что баланс каждого затронутого
+пользователя по истории не изменился, иначе день откатывается.
+
+Сворачиваются только строки, уже вошедшие в контрольную точку сверки
+(reconcile.py), либо любые, если точки у пользователя ещё нет.
+
+Запуск: python bot/compaction.py [--days N] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, insert, update, delete, func, case, or_
+
+from database import AsyncSessionLocal, init_db
+from models import User, Transaction, TransactionArchive, BalanceCheckpoint, SYSTEM_USER_ID
+from config import LEDGER_COMPACT_AFTER_DAYS
+
+logger = logging.getLogger(__name__)
+
+users = User.__table__
+transactions = Transaction.__table__
+archive = TransactionArchive.__table__
+checkpoints = BalanceCheckpoint.__table__
+
+# Ограничение на размер IN (...) и CASE в одном запросе
+CHUNK_SIZE = 500
+
+ARCHIVED_COLUMNS = ('id', 'from_user_id', 'to_user_id', 'amount', 'type', 'created_at', 'description')
+
+
+class CompactionError(Exception):
+    """Проверка не сошлась - изменения дня откатываются"""
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def ledger_net(session, user_ids):
+    """Баланс по истории: сумма зачислений минус сумма списаний"""
+    net = dict.fromkeys(user_ids, 0)
+    for chunk in _chunks(list(user_ids)):
+        incoming = await session.execute(
+            select(transactions.c.to_user_id, func.sum(transactions.c.amount))
+            .where(transactions.c.to_user_id.in_(chunk))
+            .group_by(transactions.c.to_user_id)
+        )
+        for user_id, amount in incoming:
+            net[user_id] += amount
+        outgoing = await session.execute(
+            select(transactions.c.from_user_id, func.sum(transactions.c.amount))
+            .where(transactions.c.from_user_id.in_(chunk))
+            .group_by(transactions.c.from_user_id)
+        )
+        for user_id, amount in outgoing:
+            net[user_id] -= amount
+    return net
+
+
+async def compact_day(session, day_start: datetime):
+    """Сворачивает клики одного дня в транзакции сессии, возвращает (строк, итогов)"""
+    day_end = day_start + timedelta(days=1)
+    # Итог получает новый id, и сверка пропускает его при досчёте от точки
+    checkpoint_id = (
+        select(checkpoints.c.last_transaction_id)
+        .where(checkpoints.c.user_id == transactions.c.to_user_id)
+        .scalar_subquery()
+    )
+    in_day = (
+        (transactions.c.type == 'click')
+        & (transactions.c.created_at >= day_start)
+        & (transactions.c.created_at < day_end)
+        & or_(checkpoint_id.is_(None), transactions.c.id <= checkpoint_id)
+    )
+
+    groups = (await session.execute(
+        select(transactions.c.to_user_id, func.sum(transactions.c.amount), func.count(),
+               func.max(transactions.c.created_at))
+        .where(in_day)
+        .group_by(transactions.c.to_user_id)
+    )).all()
+    if not groups:
+        return 0, 0
+
+    user_ids = [user_id for user_id, *_ in groups]
+    net_before = await ledger_net(session, user_ids)
+
+    expected_rows = sum(count for _, _, count, _ in groups)
+    archived = deleted = 0
+    for chunk in _chunks(groups):
+        # Итог датируется последним кликом дня, чтобы встать на его место в истории
+        result = await session.execute(
+            insert(transactions).returning(transactions.c.id, transactions.c.to_user_id),
+            [
+                {
+                    'from_user_id': SYSTEM_USER_ID,
+                    'to_user_id': user_id,
+                    'amount': amount,
+                    'type': 'click_summary',
+                    'created_at': last_at,
+                    'description': f"Клики за {day_start:%d.%m.%Y} ×{count}"
+                }
+                for user_id, amount, count, last_at in chunk
+            ]
+        )
+        summary_of = {user_id: summary_id for summary_id, user_id in result.all()}
+
+        in_chunk = in_day & transactions.c.to_user_id.in_(list(summary_of))
+        source = select(
+            *(transactions.c[name] for name in ARCHIVED_COLUMNS),
+            case(summary_of, value=transactions.c.to_user_id)
+        ).where(in_chunk)
+        result = await session.execute(
+            insert(archive).from_select([*ARCHIVED_COLUMNS, 'summary_id'], source)
+        )
+        archived += result.rowcount
+        result = await session.execute(delete(transactions).where(in_chunk))
+        deleted += result.rowcount
+        # count строк дня стали одним итогом
+        await session.execute(
+            update(users)
+            .where(users.c.user_id.in_(list(summary_of)))
+            .values(tx_count=users.c.tx_count - case(
+                {user_id: count - 1 for user_id, _, count, _ in chunk}, value=users.c.user_id
+            ))
+        )
+
+    if not archived == deleted == expected_rows:
+        raise CompactionError(
+            f"{day_start:%Y-%m-%d}: в архив {archived}, удалено {deleted}, ожидалось {expected_rows}"
+        )
+
+    net_after = await ledger_net(session, user_ids)
+    changed = [user_id for user_id in user_ids if net_before[user_id] != net_after[user_id]]
+    if changed:
+        raise CompactionError(f"{day_start:%Y-%m-%d}: изменился баланс по истории у {changed[:10]}")
+
+    return deleted, len(groups)
+
+
+async def compact_clicks(days=LEDGER_COMPACT_AFTER_DAYS, dry_run=False, session_pool=AsyncSessionLocal):
+    """Сворачивает клики всех дней старше days, возвращает (строк, итогов)"""
+    now = datetime.now(timezone.utc)
+    cutoff = datetime(now.year, now.month, now.day, tzinfo=timezone.utc) - timedelta(days=days)
+
+    async with session_pool() as session:
+        first = await session.scalar(
+            select(func.min(transactions.c.created_at)).where(transactions.c.type == 'click')
+        )
+    if first is None:
+        return 0, 0
+
+    day = datetime(first.year, first.month, first.day, tzinfo=timezone.utc)
+    total_rows = total_summaries = 0
+    while day < cutoff:
+        async with session_pool() as session:
+            rows, summaries = await compact_day(session, day)
+            if dry_run:
+                await session.rollback()
+            else:
+                await session.commit()
+        if rows:
+            logger.info("%s: %d кликов -> %d итогов", f"{day:%Y-%m-%d}", rows, summaries)
+        total_rows += rows
+        total_summaries += summaries
+        day += timedelta(days=1)
+
+    return total_rows, total_summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=LEDGER_COMPACT_AFTER_DAYS,
+                        help="не трогать клики моложе стольких дней")
+    parser.add_argument('--dry-run', action='store_true', help="посчитать и откатить")
+    args = parser.parse_args()
+
+    async def run():
+        # Таблица архива и индекс появляются при первом запуске после обновления
+        await init_db()
+        return await compact_clicks(args.days, args.dry_run)
+
+    logging.basicConfig(level=logging.INFO)
+    rows, summaries = asyncio.run(run())
+    action = "было бы свёрнуто" if args.dry_run else "свёрнуто"
+    print(f"Итого {action}: {rows} строк кликов в {summaries} дневных итогов")
@@ -1,20 +1,132 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-import sqlite3
-
-# Для SQLite используем aiosqlite
-DATABASE_URL = "sqlite+aiosqlite:///./bank.db"
-
-engine = create_async_engine(DATABASE_URL, echo=True)
-AsyncSessionLocal = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
-Base = declarative_base()
-
-async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
-async def get_db():
-    async with AsyncSessionLocal() as session:
+from sqlalchemy import event, inspect, text, select, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.dialects import sqlite, postgresql
+import sqlite3
+
+from config import (DATABASE_URL, DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+                    DB_STATEMENT_CACHE_SIZE, DB_QUERY_CACHE_SIZE,
+                    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT)
+
+# Синхронные драйверы по умолчанию -> их asyncio-варианты
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+}
+
+def async_url(url: str):
+    url = make_url(url)
+    if url.drivername in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[url.drivername])
+    return url
+
+def _connect_args(url):
+    if url.get_backend_name() == 'sqlite':
+        return {
+            'timeout': SQLITE_BUSY_TIMEOUT / 1000,
+            'cached_statements': DB_STATEMENT_CACHE_SIZE
+        }
+    if url.get_driver_name() == 'asyncpg':
+        return {'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE}
+    return {}
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL позволяет читать во время записи, NORMAL убирает fsync на каждый commit
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+def create_engine_for(url: str):
+    """Движок с настройками из config; PRAGMA - только для SQLite"""
+    url = async_url(url)
+    engine = create_async_engine(
+        url,
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+        connect_args=_connect_args(url)
+    )
+    if url.get_backend_name() == 'sqlite':
+        event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+engine = create_engine_for(DATABASE_URL)
+
+# INSERT ... ON CONFLICT DO UPDATE: конструктор по имени диалекта сессии
+UPSERT = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+AsyncSessionLocal = sessionmaker(
+    engine, class_=AsyncSession, expire_on_commit=False
+)
+Base = declarative_base()
+
+def _add_missing_columns(conn):
+    # create_all не меняет существующие таблицы: добавляем новые колонки сами
+    inspector = inspect(conn)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+def _index_names(conn):
+    if conn.dialect.name == 'sqlite':
+        # Инспектор SQLite пропускает индексы по выражениям (lower(username))
+        return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    inspector = inspect(conn)
+    return {
+        index['name']
+        for table in Base.metadata.sorted_tables
+        for index in inspector.get_indexes(table.name)
+    }
+
+def _create_missing_indexes(conn):
+    # create_all не добавляет новые индексы к уже существующим таблицам
+    existing = _index_names(conn)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(_add_missing_columns)
+        
+        if 'ux_users_username_lower' not in await conn.run_sync(_index_names):
+            # Уникальный индекс не создастся, пока в старых данных есть повторы
+            from recipients import release_duplicate_usernames
+            await conn.execute(release_duplicate_usernames())
+        
+        await conn.run_sync(_create_missing_indexes)
+        
+        if 'users.tx_count' in added:
+            # Счётчики только что появились - заполняем их по истории
+            from stats import rebuild_user_stats
+            await conn.execute(rebuild_user_stats())
+        
+        if conn.dialect.name != 'sqlite':
+            # SQLite внешние ключи не проверяет, остальные БД требуют строку
+            # для from_user_id=0 у бонусов и кликов
+            from models import User, SYSTEM_USER_ID
+            exists = await conn.scalar(select(User.user_id).where(User.user_id == SYSTEM_USER_ID))
+            if exists is None:
+                await conn.execute(insert(User).values(user_id=SYSTEM_USER_ID, first_name="Система", balance=0))
+
+async def get_db():
+    async with AsyncSessionLocal() as session:
         yield session
\ No newline at end of file
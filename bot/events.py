@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+from config import EVENTS_QUEUE_SIZE
+
+
+def format_event(event: dict) -> bytes:
+    """Событие в формате Server-Sent Events"""
+    data = json.dumps(event['data'], ensure_ascii=False)
+    return f"event: {event['type']}\ndata: {data}\n\n".encode('utf-8')
+
+
+class EventHub:
+    """Рассылка событий открытым вкладкам Mini App внутри процесса.
+
+    У каждой подписки своя ограниченная очередь: медленный клиент теряет
+    самые старые события (баланс в них всё равно устаревший), а не копит память.
+    События, записанные другим воркером, сюда не попадают.
+    """
+
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = {}  # user_id -> set очередей открытых вкладок
+        self._closed = False
+        self.published = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, user_id: int):
+        queue = asyncio.Queue(self.queue_size)
+        if self._closed:
+            queue.put_nowait(None)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id: int, event_type: str, **data):
+        for queue in self._subscribers.get(user_id, ()):
+            self._put(queue, {'type': event_type, 'data': data})
+            self.published += 1
+
+    def balance(self, user_id: int, balance: int):
+        """Новый баланс после записи в БД"""
+        self.publish(user_id, 'balance', balance=balance)
+
+    def close(self):
+        """Завершает все подписки (None в очереди) - при остановке сервера"""
+        self._closed = True
+        for queues in self._subscribers.values():
+            for queue in queues:
+                self._put(queue, None)
+
+    def _put(self, queue, event):
+        if queue.full():
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(event)
+
+    def stats(self):
+        return {
+            'users': len(self._subscribers),
+            'subscriptions': len(self),
+            'published': self.published,
+            'dropped': self.dropped
+        }
+
+
+event_hub = EventHub()
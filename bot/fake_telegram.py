@@ -0,0 +1,156 @@
+"""Локальная замена Telegram для проверки режима вебхука.
+
+api      - поддельный Bot API: на любой метод отвечает успехом и считает вызовы.
+           Бот подключается к нему через TELEGRAM_API_URL=http://127.0.0.1:8081
+generate - пишет в stdout синтетические апдейты (JSON по строке на апдейт)
+replay   - отправляет записанные апдейты на вебхук бота, как это делает Telegram
+
+Пример:
+  python bot/fake_telegram.py api &
+  BOT_MODE=webhook WEBHOOK_HOST=http://127.0.0.1:3001 WEBHOOK_SECRET=local TELEGRAM_API_URL=http://127.0.0.1:8081 python bot/main.py &
+  python bot/fake_telegram.py generate 100 20 > updates.jsonl
+  WEBHOOK_SECRET=local python bot/fake_telegram.py replay updates.jsonl
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+from config import WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bank', 'username': 'bank_bot'}
+
+# Кнопки, которые нажимают синтетические пользователи
+ACTIONS = ["🖱 Кликнуть +10₽", "🖱 Кликнуть +10₽", "🖱 Кликнуть +10₽", "📊 Профиль", "💰 Мой Банк"]
+
+
+def run_api(port: int):
+    calls = Counter()
+    message_ids = iter(range(1, sys.maxsize))
+
+    async def handle_method(request):
+        method = request.match_info['method']
+        data = await request.post()
+        calls[method] += 1
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in ('sendMessage', 'editMessageText'):
+            result = {
+                'message_id': next(message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'},
+                'from': BOT_USER,
+                'text': data.get('text', '')
+            }
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_stats(request):
+        return web.json_response(dict(calls))
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handle_method)
+    app.router.add_get('/stats', handle_stats)
+    try:
+        web.run_app(app, host='127.0.0.1', port=port)
+    finally:
+        print("Вызовы Bot API:", dict(calls))
+
+
+def generate(users: int, per_user: int):
+    """Апдейты как от Telegram: /start, затем случайные кнопки"""
+    update_id = 0
+    updates = []
+    for user_id in range(1, users + 1):
+        texts = ["/start"] + [random.choice(ACTIONS) for _ in range(per_user)]
+        for n, text in enumerate(texts):
+            updates.append((n, user_id, text))
+
+    # Пользователи действуют вперемешку, но каждый начинает с /start
+    updates.sort(key=lambda u: (u[0], random.random()))
+    for _, user_id, text in updates:
+        update_id += 1
+        print(json.dumps({
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}',
+                         'username': f'user{user_id}'},
+                'text': text
+            }
+        }, ensure_ascii=False))
+
+
+def load_updates(path: str):
+    """Строки JSON с апдейтами или сохранённый ответ getUpdates"""
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    if text.startswith('{"ok"'):
+        return json.loads(text)['result']
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def replay(path: str, url: str, concurrency: int):
+    updates = load_updates(path)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    latencies = []
+    errors = Counter()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(http, update):
+        async with slots:
+            started = time.perf_counter()
+            async with http.post(url, json=update, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors[response.status] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        await asyncio.gather(*(send(http, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"{len(updates)} апдейтов за {elapsed:.2f}с ({len(updates) / elapsed:.0f}/с), "
+          f"ответ p50 {p50:.1f}мс, p95 {p95:.1f}мс")
+    if errors:
+        print("Ошибки:", dict(errors))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    api = commands.add_parser('api', help="поддельный Bot API")
+    api.add_argument('--port', type=int, default=8081)
+
+    gen = commands.add_parser('generate', help="синтетические апдейты в stdout")
+    gen.add_argument('users', type=int)
+    gen.add_argument('per_user', type=int)
+
+    rep = commands.add_parser('replay', help="отправить апдейты на вебхук")
+    rep.add_argument('path')
+    rep.add_argument('--url', default=f"http://{WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    rep.add_argument('--concurrency', type=int, default=40)
+
+    args = parser.parse_args()
+    if args.command == 'api':
+        run_api(args.port)
+    elif args.command == 'generate':
+        generate(args.users, args.per_user)
+    else:
+        asyncio.run(replay(args.path, args.url, args.concurrency))
@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import select, update, delete
+
+from database import AsyncSessionLocal, UPSERT
+from models import FsmState
+from config import FSM_STORAGE, FSM_STORAGE_PATH
+
+
+def _state_name(state):
+    return state.state if isinstance(state, State) else state
+
+
+class DatabaseStorage(BaseStorage):
+    """FSM в таблице fsm_states основной БД: состояние видят все воркеры"""
+
+    def __init__(self, session_pool=AsyncSessionLocal, key_builder=None):
+        self.session_pool = session_pool
+        self.key_builder = key_builder or DefaultKeyBuilder()
+
+    async def _upsert(self, key, **values):
+        async with self.session_pool() as session:
+            async with session.begin():
+                upsert = UPSERT[session.bind.dialect.name](FsmState)
+                await session.execute(
+                    upsert.values(key=self.key_builder.build(key), **values)
+                    .on_conflict_do_update(index_elements=[FsmState.key], set_=values)
+                )
+
+    async def _get(self, key):
+        async with self.session_pool() as session:
+            return (await session.execute(
+                select(FsmState.state, FsmState.data).where(FsmState.key == self.key_builder.build(key))
+            )).first()
+
+    async def set_state(self, key, state=None):
+        await self._upsert(key, state=_state_name(state))
+
+    async def get_state(self, key):
+        row = await self._get(key)
+        return row.state if row else None
+
+    async def set_data(self, key, data):
+        if data:
+            await self._upsert(key, data=json.dumps(dict(data), ensure_ascii=False))
+            return
+
+        # После state.clear() строка не остаётся
+        condition = FsmState.key == self.key_builder.build(key)
+        async with self.session_pool() as session:
+            async with session.begin():
+                await session.execute(update(FsmState).where(condition).values(data=None))
+                await session.execute(delete(FsmState).where(condition, FsmState.state.is_(None)))
+
+    async def get_data(self, key):
+        row = await self._get(key)
+        return json.loads(row.data) if row and row.data else {}
+
+    async def close(self):
+        pass
+
+
+class FileStorage(BaseStorage):
+    """FSM в файлах каталога path (на /dev/shm - фактически в общей памяти).
+
+    Состояние и данные лежат в разных файлах, поэтому запись одного
+    не требует чтения другого; файл заменяется атомарно через os.replace.
+    """
+
+    def __init__(self, path=FSM_STORAGE_PATH, key_builder=None):
+        self.path = path
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key, part):
+        name = hashlib.sha1(self.key_builder.build(key, part).encode()).hexdigest()
+        return os.path.join(self.path, f"{name}.json")
+
+    def _read(self, file):
+        try:
+            with open(file, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, file, value):
+        if value is None:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, file)
+
+    async def set_state(self, key, state=None):
+        await asyncio.to_thread(self._write, self._file(key, 'state'), _state_name(state))
+
+    async def get_state(self, key):
+        return await asyncio.to_thread(self._read, self._file(key, 'state'))
+
+    async def set_data(self, key, data):
+        await asyncio.to_thread(self._write, self._file(key, 'data'), dict(data) or None)
+
+    async def get_data(self, key):
+        return await asyncio.to_thread(self._read, self._file(key, 'data')) or {}
+
+    async def close(self):
+        pass
+
+
+def create_storage(kind=FSM_STORAGE):
+    if kind == 'memory':
+        return MemoryStorage()
+    if kind == 'db':
+        return DatabaseStorage()
+    if kind == 'file':
+        return FileStorage()
+    raise ValueError(f"Неизвестное хранилище FSM: {kind}")
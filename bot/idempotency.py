@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from config import IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_CACHE_TTL
+
+
+class IdempotencyConflict(Exception):
+    """Ключ уже использован с другими параметрами запроса"""
+
+
+class IdempotencyCache:
+    """Результаты запросов по ключу идемпотентности.
+
+    Готовые ответы хранятся в ограниченном LRU-кэше с TTL, повтор отдаётся
+    из памяти без обращения к БД. Пока первый запрос с ключом выполняется,
+    дубликаты ждут его результат, а не выполняются параллельно.
+    """
+
+    def __init__(self, size=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._results = OrderedDict()  # key -> (fingerprint, result, expires_at)
+        self._inflight = {}  # key -> (fingerprint, Future)
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, fingerprint):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+
+        stored_fingerprint, result, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._results[key]
+            return None
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflict()
+
+        self._results.move_to_end(key)
+        return result
+
+    def _store(self, key, fingerprint, result):
+        self._results[key] = (fingerprint, result, time.monotonic() + self.ttl)
+        self._results.move_to_end(key)
+        while len(self._results) > self.size:
+            self._results.popitem(last=False)
+
+    async def run(self, key, fingerprint, func, cacheable=lambda result: True):
+        """Выполняет func() один раз на ключ; повторы получают тот же результат"""
+        result = self._get(key, fingerprint)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            inflight_fingerprint, future = inflight
+            if inflight_fingerprint != fingerprint:
+                raise IdempotencyConflict()
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        try:
+            result = await func()
+        except BaseException as e:
+            future.set_exception(e)
+            # Ошибку получат ожидающие дубликаты; без них не предупреждать о потерянном исключении
+            future.exception()
+            raise
+        else:
+            if cacheable(result):
+                self._store(key, fingerprint, result)
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
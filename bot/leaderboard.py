@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import math
+import random
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import User, SYSTEM_USER_ID
+from config import LEADERBOARD_RESYNC
+
+logger = logging.getLogger(__name__)
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels  # сколько элементов нижнего уровня перескакивает ссылка
+
+
+_TAIL = _Node((math.inf,), 0)  # ключ больше любого (-balance, user_id)
+
+
+class RankedSkiplist:
+    """Упорядоченное множество ключей со списком пропусков и шириной ссылок.
+
+    Вставка, удаление и позиция ключа - O(log n), первые k элементов - O(k).
+    """
+
+    MAX_LEVELS = 32
+
+    def __init__(self):
+        self.head = _Node(None, self.MAX_LEVELS)
+        self.head.next = [_TAIL] * self.MAX_LEVELS
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_sorted(cls, keys):
+        """Построение из отсортированных ключей за O(n) - без поиска места для каждого"""
+        skiplist = cls()
+        last = [skiplist.head] * cls.MAX_LEVELS  # последний узел на каждом уровне
+        last_position = [0] * cls.MAX_LEVELS     # его позиция, у head - 0
+        position = 0
+        for position, key in enumerate(keys, 1):
+            node = _Node(key, skiplist._level())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level], last_position[level] = node, position
+        for level in range(cls.MAX_LEVELS):
+            last[level].next[level] = _TAIL
+            last[level].width[level] = position + 1 - last_position[level]
+        skiplist.size = position
+        return skiplist
+
+    def _level(self):
+        level = 1
+        while level < self.MAX_LEVELS and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        chain = [None] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS  # пройдено элементов на каждом уровне
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._level()
+        new = _Node(key, levels)
+        passed = 0
+        for level in range(levels):
+            previous = chain[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - passed
+            previous.width[level] = passed + 1
+            passed += steps[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key):
+        """Сколько ключей меньше key (позиция key, если он есть)"""
+        position = 0
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def first(self, count: int):
+        node = self.head.next[0]
+        while count > 0 and node is not _TAIL:
+            yield node.key
+            node = node.next[0]
+            count -= 1
+
+
+class Leaderboard:
+    """Рейтинг пользователей по балансу в памяти процесса.
+
+    Загружается из users при запуске и обновляется в тех же местах, что и кэш
+    балансов: после записи кликов, автокликера и переводов. При одинаковом
+    балансе выше тот, у кого меньший user_id (порядок регистрации он не отражает).
+    Записи других воркеров подхватываются полной перезагрузкой раз в resync секунд.
+    """
+
+    def __init__(self, resync=LEADERBOARD_RESYNC):
+        self.resync = resync
+        self._ranked = RankedSkiplist()
+        self._balances = {}  # user_id -> баланс в рейтинге
+        self._loading = None  # изменения, пришедшие во время перезагрузки
+        self._task = None
+
+    def __len__(self):
+        return len(self._balances)
+
+    def update(self, user_id: int, balance: int):
+        if user_id == SYSTEM_USER_ID:
+            return
+        if self._loading is not None:
+            self._loading[user_id] = balance
+        previous = self._balances.get(user_id)
+        if previous == balance:
+            return
+        if previous is not None:
+            self._ranked.remove((-previous, user_id))
+        self._ranked.insert((-balance, user_id))
+        self._balances[user_id] = balance
+
+    def top(self, count: int):
+        """[(user_id, баланс)] по убыванию баланса"""
+        return [(user_id, -balance) for balance, user_id in self._ranked.first(count)]
+
+    def rank(self, user_id: int):
+        """Место пользователя (с 1) или None, если его нет в рейтинге"""
+        balance = self._balances.get(user_id)
+        if balance is None:
+            return None
+        return self._ranked.index((-balance, user_id)) + 1
+
+    def balance(self, user_id: int):
+        return self._balances.get(user_id)
+
+    async def entries(self, session, count: int):
+        """Первые count мест с именами - один запрос к users"""
+        top = self.top(count)
+        names = {}
+        if top:
+            result = await session.execute(
+                select(User.user_id, User.username, User.first_name)
+                .where(User.user_id.in_([user_id for user_id, _ in top]))
+            )
+            names = {user_id: (username, first_name) for user_id, username, first_name in result}
+        return [
+            {
+                'rank': place,
+                'id': user_id,
+                'username': names.get(user_id, (None, None))[0],
+                'first_name': names.get(user_id, (None, None))[1],
+                'balance': balance
+            }
+            for place, (user_id, balance) in enumerate(top, 1)
+        ]
+
+    async def load(self, session_pool=AsyncSessionLocal):
+        """Строит рейтинг заново из users, возвращает число пользователей"""
+        self._loading = {}
+        try:
+            async with session_pool() as session:
+                rows = (await session.execute(
+                    select(User.user_id, User.balance).where(User.user_id != SYSTEM_USER_ID)
+                )).all()
+            self._ranked = RankedSkiplist.from_sorted(sorted((-balance, user_id) for user_id, balance in rows))
+            self._balances = dict(rows)
+            # Записи, сделанные, пока читали users, новее прочитанного
+            pending, self._loading = self._loading, None
+            for user_id, balance in pending.items():
+                self.update(user_id, balance)
+        finally:
+            self._loading = None
+        return len(self._balances)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.resync)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Не удалось перезагрузить рейтинг")
+
+    async def start(self):
+        logger.info("Рейтинг: загружено %d пользователей", await self.load())
+        if self.resync > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import logging
+import random
+from collections import deque
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from database import AsyncSessionLocal
+from balance_cache import balance_cache
+from events import event_hub
+from leaderboard import leaderboard
+from config import LEDGER_WRITE_WINDOW, LEDGER_WRITE_BATCH, TRANSFER_RETRIES, TRANSFER_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+def is_locked(error: OperationalError):
+    return 'database is locked' in str(error.orig)
+
+
+def write_through(rows):
+    """Новые строки users (stats.LEDGER_COLUMNS) - в кэш, рейтинг и открытым вкладкам Mini App"""
+    for row in rows:
+        balance_cache.apply(row)
+        leaderboard.update(row.user_id, row.balance)
+        event_hub.balance(row.user_id, row.balance)
+
+
+class _Entry:
+    __slots__ = ('operation', 'on_commit', 'future', 'context')
+
+    def __init__(self, operation, on_commit, future):
+        self.operation = operation
+        self.on_commit = on_commit
+        self.future = future
+        # Контекст вызывающего: запросы операции видят его счётчики (metrics, benchmark)
+        self.context = contextvars.copy_context()
+
+
+class LedgerWriter:
+    """Единственный писатель балансов и истории в процессе (group commit).
+
+    Операция - корутина operation(session), которая пишет через переданную
+    сессию и возвращает результат. Всё, что пришло за window секунд (и пока
+    шёл предыдущий коммит), выполняется одной транзакцией: один коммит,
+    одна блокировка записи SQLite вместо своей на каждую операцию.
+    Каждая операция - в своей точке сохранения: её ошибка (нехватка средств,
+    повтор ключа идемпотентности) откатывает только её и возвращается
+    вызывающему, остальные операции пачки фиксируются. Одиночная операция
+    (обычное дело при малой нагрузке) идёт без точки сохранения.
+    При блокировке БД пачка повторяется целиком.
+
+    on_commit(result) вызывается после коммита, до того как вызывающий
+    получит результат - здесь обновляются кэши.
+
+    У писателя своё соединение, взятое при запуске: иначе хэндлеры, которые
+    держат соединения пула и ждут писателя, могут занять весь пул.
+    Операция выполняется в копии контекста вызывающего, поэтому её SQL-запросы
+    (вместе с точкой сохранения) засчитываются его апдейту или HTTP-запросу.
+    """
+
+    def __init__(self, window=LEDGER_WRITE_WINDOW, max_batch=LEDGER_WRITE_BATCH,
+                 retries=TRANSFER_RETRIES, retry_delay=TRANSFER_RETRY_DELAY, session_pool=AsyncSessionLocal):
+        self.window = window
+        self.max_batch = max_batch
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.session_pool = session_pool
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._connection = None
+        self._stopping = False
+        self.batches = 0
+        self.operations = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    async def submit(self, operation, on_commit=None):
+        """Ставит операцию в очередь и ждёт её результата после коммита"""
+        if self._task is None:
+            # Скрипты, которые не вызвали start() (stress_transfers.py)
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(_Entry(operation, on_commit, future))
+        self._wakeup.set()
+        return await future
+
+    async def _connect(self):
+        if self._connection is None:
+            self._connection = await self.session_pool.kw['bind'].connect()
+        return self._connection
+
+    async def _disconnect(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            try:
+                await connection.close()
+            except Exception:
+                logger.exception("Не удалось закрыть соединение записи")
+
+    async def _run(self):
+        try:
+            await self._connect()
+        except Exception:
+            logger.exception("Нет соединения с БД для записи, повторим с первой операцией")
+        while True:
+            if not self._queue:
+                if self._stopping:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                # Первая операция после простоя: ждём соседей, с которыми её можно закоммитить
+                if self.window > 0 and not self._stopping:
+                    await asyncio.sleep(self.window)
+                continue
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch:
+                entry = self._queue.popleft()
+                if not entry.future.cancelled():
+                    batch.append(entry)
+            if batch:
+                await self._commit(batch)
+
+    async def _commit(self, batch):
+        attempt = 0
+        while True:
+            try:
+                outcomes = await self._execute(batch)
+                break
+            except OperationalError as e:
+                if not is_locked(e) or attempt >= self.retries:
+                    self._fail(batch, e)
+                    return
+                delay = self.retry_delay * (2 ** attempt) * (0.5 + random.random())
+                attempt += 1
+                logger.warning("Запись %d операций: база заблокирована, повтор %d через %.2fс",
+                               len(batch), attempt, delay)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                logger.exception("Не удалось записать %d операций", len(batch))
+                # Соединение могло остаться в неизвестном состоянии - следующая пачка возьмёт новое
+                await self._disconnect()
+                self._fail(batch, e)
+                return
+
+        self.batches += 1
+        self.operations += len(batch)
+        for entry, (error, result) in zip(batch, outcomes):
+            if error is None and entry.on_commit is not None:
+                try:
+                    entry.on_commit(result)
+                except Exception:
+                    logger.exception("Ошибка обработчика после коммита")
+            if entry.future.done():
+                continue
+            if error is None:
+                entry.future.set_result(result)
+            else:
+                entry.future.set_exception(error)
+
+    async def _execute(self, batch):
+        """[(ошибка или None, результат)] по операциям пачки"""
+        outcomes = []
+        # Одной операции точка сохранения не нужна: при её ошибке откатывается вся транзакция
+        savepoints = len(batch) > 1
+        async with self.session_pool(bind=await self._connect()) as session:
+            transaction = await session.begin()
+            try:
+                if session.bind.dialect.name == 'sqlite':
+                    # Драйвер SQLite сам начинает транзакцию только перед изменением данных,
+                    # и без явного BEGIN первая точка сохранения коммитилась бы отдельно.
+                    # IMMEDIATE сразу берёт блокировку записи
+                    await session.execute(text("BEGIN IMMEDIATE"))
+                for entry in batch:
+                    task = entry.context.run(asyncio.create_task, self._apply(session, entry, savepoints))
+                    outcomes.append(await task)
+                if savepoints or outcomes[0][0] is None:
+                    await transaction.commit()
+                else:
+                    await transaction.rollback()
+            except BaseException:
+                await transaction.rollback()
+                raise
+        return outcomes
+
+    async def _apply(self, session, entry, savepoint: bool):
+        try:
+            if savepoint:
+                async with session.begin_nested():
+                    result = await entry.operation(session)
+            else:
+                result = await entry.operation(session)
+        except OperationalError as e:
+            if is_locked(e):
+                raise  # вся пачка повторяется
+            return e, None
+        except Exception as e:
+            return e, None
+        return None, result
+
+    def _fail(self, batch, error):
+        for entry in batch:
+            if not entry.future.done():
+                entry.future.set_exception(error)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            # Чистый контекст: иначе задача унаследует contextvars того, кто её запустил
+            self._task = contextvars.Context().run(asyncio.create_task, self._run())
+
+    async def stop(self):
+        """Дописывает очередь и останавливает запись"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self._disconnect()
+
+    def stats(self):
+        return {
+            'queued': len(self._queue),
+            'batches': self.batches,
+            'operations': self.operations,
+            'per_batch': self.operations / self.batches if self.batches else 0.0
+        }
+
+
+ledger_writer = LedgerWriter()
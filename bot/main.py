@@ -1,33 +1,128 @@
-import asyncio
-import logging
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-
-from config import BOT_TOKEN
-from database import init_db
-from handlers import router
-from web_app_server import WebAppServer
-
-logging.basicConfig(level=logging.INFO)
-
-async def main():
-    # Инициализация базы данных
-    await init_db()
-    
-    # Инициализация бота и диспетчера
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
-    
-    # Регистрация роутеров
-    dp.include_router(router)
-    
-    # Запуск сервера для Mini App
-    web_app_server = WebAppServer()
-    asyncio.create_task(web_app_server.start(bot))
-    
-    # Запуск бота
-    await dp.start_polling(bot)
-
-if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+import asyncio
+import logging
+import signal
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config import BOT_TOKEN, BOT_MODE, TELEGRAM_API_URL, SUPERVISED, IS_PRIMARY, METRICS_ENABLED
+from database import init_db, AsyncSessionLocal
+from handlers import router
+from middlewares import DbSessionMiddleware
+from rate_limit import BotRateLimitMiddleware
+from web_app_server import WebAppServer
+from click_aggregator import click_aggregator
+from ledger_writer import ledger_writer
+from auto_clicker import auto_clicker
+from reconcile import reconciler
+from leaderboard import leaderboard
+from notifications import notifier
+from webhook import setup_webhook, set_webhook
+from fsm_storage import create_storage
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+async def wait_for_shutdown():
+    """Ждёт SIGTERM или SIGINT, как start_polling в режиме polling.
+
+    asyncio.run сам ловит только SIGINT: SIGTERM при перезапуске убил бы процесс
+    без finally в main, и принятые, но не записанные клики потерялись бы.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+
+async def main():
+    # Инициализация базы данных (при запуске через supervisor.py её уже сделал он)
+    if not SUPERVISED:
+        await init_db()
+    
+    # Инициализация бота и диспетчера
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=BOT_TOKEN, session=session)
+    storage = create_storage()
+    dp = Dispatcher(storage=storage)
+    
+    # Флуд отсекается до открытия сессии, остальные апдейты ждут место в лимите одновременности
+    dp.update.outer_middleware(BotRateLimitMiddleware())
+    # Сессия БД на каждый апдейт
+    dp.update.outer_middleware(DbSessionMiddleware(AsyncSessionLocal))
+    
+    # Регистрация роутеров
+    dp.include_router(router)
+    
+    # Замеры хэндлеров и запросов к БД (без METRICS_ENABLED ничего не подключается)
+    if METRICS_ENABLED:
+        metrics.instrument_router(router)
+        metrics.instrument_engine()
+    
+    # Рейтинг по балансу (его читают и бот, и API Mini App) - загружается до приёма запросов
+    await leaderboard.start()
+    
+    # Единственный писатель балансов и истории: операции всех корутин - пачками в одной транзакции
+    ledger_writer.start()
+    
+    # Запуск сервера для Mini App
+    web_app_server = WebAppServer()
+    webhook_handler = None
+    if BOT_MODE == "webhook":
+        # Апдейты принимает тот же aiohttp сервер, что и API Mini App
+        webhook_handler = setup_webhook(web_app_server.app, dp, bot)
+    if METRICS_ENABLED:
+        metrics.register_runtime_gauges(webhook_handler)
+    await web_app_server.start(bot)
+    
+    # Очередь уведомлений
+    notifier.start(bot)
+    
+    # Фоновая запись накопленных кликов
+    click_aggregator.start()
+    
+    # Планировщик автокликеров (восстанавливает активных из БД) - один на все воркеры
+    if IS_PRIMARY:
+        await auto_clicker.start()
+    
+    # Периодическая сверка балансов с историей (RECONCILE_INTERVAL=0 - выключена)
+    if IS_PRIMARY:
+        reconciler.start()
+    
+    # Запуск бота
+    try:
+        if BOT_MODE == "webhook":
+            if IS_PRIMARY:
+                await set_webhook(bot, dp)
+            await wait_for_shutdown()
+        elif not IS_PRIMARY:
+            # getUpdates может читать только один процесс, остальные обслуживают Mini App
+            await wait_for_shutdown()
+        else:
+            # Оставшийся вебхук мешает getUpdates
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        # Сначала перестаём принимать апдейты и дожидаемся начатых
+        await web_app_server.stop()
+        await auto_clicker.stop()
+        await reconciler.stop()
+        await leaderboard.stop()
+        # Дописываем в БД клики, принятые до остановки
+        await click_aggregator.stop()
+        await ledger_writer.stop()
+        await notifier.stop()
+        await dp.storage.close()
+        await bot.session.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
\ No newline at end of file
@@ -0,0 +1,237 @@
+"""Метрики в текстовом формате Prometheus (GET /metrics сервера Mini App).
+
+Включаются METRICS_ENABLED=1. Выключенные метрики ничего не стоят:
+middleware и обработчики событий SQLAlchemy не регистрируются вовсе.
+
+- bank_handler_duration_seconds       - хэндлеры aiogram из handlers.router
+- bank_http_request_duration_seconds  - маршруты aiohttp WebAppServer
+- bank_db_query_duration_seconds      - каждый SQL-запрос по типу (SELECT, UPDATE...)
+- bank_request_db_queries / _seconds  - число и время запросов к БД на апдейт или HTTP-запрос
+- bank_queue_depth                    - очереди фоновых задач
+- bank_cache_*                        - размер, попадания и доля попаданий кэшей
+- bank_rate_limited_total / bank_overloaded_total - отказы лимитов rate_limit.py
+
+Каждый воркер считает свои метрики, номер воркера - в метке worker.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from balance_cache import balance_cache
+from recipients import recipient_resolver
+from click_aggregator import click_aggregator
+from auto_clicker import auto_clicker
+from notifications import notifier
+from events import event_hub
+from rate_limit import rate_limiter
+from ledger_writer import ledger_writer
+from config import WORKER_ID
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+def _labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Histogram:
+    """Гистограмма с метками: для каждого набора меток счётчики по корзинам, сумма и число"""
+
+    def __init__(self, name, help_text, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = ('worker',) + tuple(labelnames)
+        self.buckets = buckets
+        self._series = {}  # метки -> [по корзинам..., +Inf, сумма]
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            values = (WORKER_ID,) + labels
+            bucket_names = self.labelnames + ('le',)
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                total += count
+                yield f"{self.name}_bucket{_labels(bucket_names, values + (bound,))} {total}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {total}"
+
+
+class CallbackGauge:
+    """Значения читаются в момент запроса /metrics: callback -> {значение метки: число}"""
+
+    def __init__(self, name, help_text, labelname, callback, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.labelnames = ('worker', labelname)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for label, value in self.callback().items():
+            yield f"{self.name}{_labels(self.labelnames, (WORKER_ID, label))} {value}"
+
+
+HANDLER_SECONDS = Histogram('bank_handler_duration_seconds', "Время хэндлера aiogram",
+                            ('handler', 'event', 'status'))
+HTTP_SECONDS = Histogram('bank_http_request_duration_seconds', "Время обработки HTTP-запроса",
+                         ('route', 'method', 'status'))
+DB_QUERY_SECONDS = Histogram('bank_db_query_duration_seconds', "Время SQL-запроса", ('operation',))
+REQUEST_DB_QUERIES = Histogram('bank_request_db_queries', "SQL-запросов на апдейт или HTTP-запрос",
+                               ('source', 'name'), buckets=COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('bank_request_db_seconds', "Время SQL-запросов на апдейт или HTTP-запрос",
+                               ('source', 'name'))
+
+REGISTRY = [HANDLER_SECONDS, HTTP_SECONDS, DB_QUERY_SECONDS, REQUEST_DB_QUERIES, REQUEST_DB_SECONDS]
+
+# Счётчики SQL текущего апдейта или HTTP-запроса: [запросов, секунд]
+_request_db = ContextVar('metrics_request_db', default=None)
+
+
+@contextmanager
+def request_scope(source: str, name: str):
+    """Считает SQL-запросы, выполненные внутри блока (в том же контексте asyncio)"""
+    token = _request_db.set([0, 0.0])
+    try:
+        yield
+    finally:
+        queries, seconds = _request_db.get()
+        _request_db.reset(token)
+        REQUEST_DB_QUERIES.observe((source, name), queries)
+        REQUEST_DB_SECONDS.observe((source, name), seconds)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    DB_QUERY_SECONDS.observe((statement.split(None, 1)[0].upper(),), elapsed)
+    current = _request_db.get()
+    if current is not None:
+        current[0] += 1
+        current[1] += elapsed
+
+
+def instrument_engine():
+    """Время каждого SQL-запроса - для всех движков процесса"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время хэндлера и его запросы к БД"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        name = data['handler'].callback.__name__
+        event_type = type(event).__name__
+        status = 'error'
+        started = time.perf_counter()
+        with request_scope('bot', name):
+            try:
+                result = await handler(event, data)
+                status = 'ok'
+                return result
+            finally:
+                HANDLER_SECONDS.observe((name, event_type, status), time.perf_counter() - started)
+
+
+def instrument_router(router):
+    """Вешает замер на все типы апдейтов, у которых в router есть хэндлеры"""
+    middleware = HandlerMetricsMiddleware()
+    for name, observer in router.observers.items():
+        if name != 'error' and observer.handlers:
+            observer.middleware(middleware)
+
+
+@web.middleware
+async def http_middleware(request, handler):
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else 'unmatched'
+    status = 500
+    started = time.perf_counter()
+    with request_scope('http', route):
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            HTTP_SECONDS.observe((route, request.method, status), time.perf_counter() - started)
+
+
+def register_runtime_gauges(webhook_handler=None):
+    """Очереди фоновых задач и кэши процесса"""
+
+    def queues():
+        depth = {
+            'click_aggregator': len(click_aggregator),
+            'ledger_writer': len(ledger_writer),
+            'notifications': len(notifier),
+            'auto_clicker': len(auto_clicker),
+            'event_subscriptions': len(event_hub),
+            'db_slots_waiting': rate_limiter.waiting,
+            'db_slots_active': rate_limiter.active,
+        }
+        if webhook_handler is not None:
+            depth['webhook_inflight'] = len(webhook_handler)
+        return depth
+
+    caches = {'balance': balance_cache, 'recipient': recipient_resolver}
+
+    def cache_stat(key):
+        return lambda: {name: cache.stats()[key] for name, cache in caches.items()}
+
+    REGISTRY.extend([
+        CallbackGauge('bank_queue_depth', "Элементов в очереди фоновой задачи", 'queue', queues),
+        CallbackGauge('bank_cache_size', "Записей в кэше", 'cache', cache_stat('size')),
+        CallbackGauge('bank_cache_hits_total', "Попаданий в кэш", 'cache', cache_stat('hits'), 'counter'),
+        CallbackGauge('bank_cache_misses_total', "Промахов кэша", 'cache', cache_stat('misses'), 'counter'),
+        CallbackGauge('bank_cache_hit_ratio', "Доля попаданий в кэш", 'cache', cache_stat('hit_ratio')),
+        CallbackGauge('bank_rate_limited_total', "Запросов, отклонённых лимитом частоты", 'action',
+                      lambda: rate_limiter.rejected, 'counter'),
+        CallbackGauge('bank_overloaded_total', "Запросов API и апдейтов бота, не дождавшихся места в лимите одновременности",
+                      'source', lambda: rate_limiter.overloaded, 'counter'),
+    ])
+
+
+def render():
+    lines = [line for metric in REGISTRY for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8',
+                        headers={'Cache-Control': 'no-store'})
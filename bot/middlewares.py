@@ -0,0 +1,31 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Открывает сессию БД на каждый апдейт и фиксирует её один раз в конце.
+
+    Хэндлеры получают сессию аргументом session и сами commit не вызывают:
+    при успешной обработке изменения коммитятся, при исключении - откатываются.
+    """
+
+    def __init__(self, session_pool):
+        self.session_pool = session_pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        async with self.session_pool() as session:
+            data['session'] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            await session.commit()
+            return result
@@ -1,28 +1,92 @@
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, ForeignKey, Text, Boolean
-from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
-from database import Base
-
-class User(Base):
-    __tablename__ = 'users'
-    
-    user_id = Column(BigInteger, primary_key=True)
-    username = Column(String(100), nullable=True)
-    first_name = Column(String(100))
-    balance = Column(Integer, default=0)
-    registered_at = Column(DateTime(timezone=True), server_default=func.now())
-    auto_clicker_active = Column(Boolean, default=False)
-    
-    transactions = relationship("Transaction", foreign_keys="[Transaction.from_user_id]")
-    received_transactions = relationship("Transaction", foreign_keys="[Transaction.to_user_id]")
-
-class Transaction(Base):
-    __tablename__ = 'transactions'
-    
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    from_user_id = Column(BigInteger, ForeignKey('users.user_id'))
-    to_user_id = Column(BigInteger, ForeignKey('users.user_id'))
-    amount = Column(Integer)
-    type = Column(Text)  # 'click', 'transfer', 'bonus'
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    description = Column(String(200), nullable=True)
\ No newline at end of file
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, ForeignKey, Text, Boolean, Index
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from database import Base
+
+# Системный пользователь: отправитель бонусов и кликов
+SYSTEM_USER_ID = 0
+
+# В SQLite server_default=now() пишет время без микросекунд ('YYYY-MM-DD HH:MM:SS').
+# Привязываемые из Python значения пишем в том же формате, иначе сравнение
+# строк в курсорной пагинации расходится с сохранёнными значениями.
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(truncate_microseconds=True), 'sqlite'
+)
+
+class User(Base):
+    __tablename__ = 'users'
+    
+    user_id = Column(BigInteger, primary_key=True)
+    username = Column(String(100), nullable=True)
+    first_name = Column(String(100))
+    balance = Column(Integer, default=0)
+    registered_at = Column(DateTime(timezone=True), server_default=func.now())
+    auto_clicker_active = Column(Boolean, default=False)
+    
+    # Счётчики для профиля, обновляются в той же транзакции, что и запись в истории
+    tx_count = Column(Integer, default=0, server_default='0')
+    total_in = Column(Integer, default=0, server_default='0')
+    total_out = Column(Integer, default=0, server_default='0')
+    last_activity_at = Column(Timestamp, nullable=True)
+    
+    transactions = relationship("Transaction", foreign_keys="[Transaction.from_user_id]")
+    received_transactions = relationship("Transaction", foreign_keys="[Transaction.to_user_id]")
+    
+    # Поиск получателя по @username без учёта регистра и автодополнение по префиксу
+    __table_args__ = (
+        Index('ux_users_username_lower', func.lower(username), unique=True),
+    )
+
+class Transaction(Base):
+    __tablename__ = 'transactions'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    from_user_id = Column(BigInteger, ForeignKey('users.user_id'))
+    to_user_id = Column(BigInteger, ForeignKey('users.user_id'))
+    amount = Column(Integer)
+    type = Column(Text)  # 'click', 'transfer', 'bonus'
+    created_at = Column(Timestamp, server_default=func.now())
+    description = Column(String(200), nullable=True)
+    idempotency_key = Column(String(64), nullable=True)  # Idempotency-Key перевода из Mini App
+    
+    # Индексы под историю: каждая ветка UNION идёт по своему индексу
+    __table_args__ = (
+        Index('ix_transactions_from_created', 'from_user_id', 'created_at', 'id'),
+        Index('ix_transactions_to_created', 'to_user_id', 'created_at', 'id'),
+        Index('ux_transactions_idempotency', 'from_user_id', 'idempotency_key', unique=True),
+        # Отбор старых кликов для сжатия истории (compaction.py)
+        Index('ix_transactions_type_created', 'type', 'created_at'),
+    )
+
+# Исходные строки кликов, свёрнутые compaction.py в дневные итоги ('click_summary')
+class TransactionArchive(Base):
+    __tablename__ = 'transactions_archive'
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)  # id из transactions
+    from_user_id = Column(BigInteger)
+    to_user_id = Column(BigInteger)
+    amount = Column(Integer)
+    type = Column(Text)
+    created_at = Column(Timestamp)
+    description = Column(String(200), nullable=True)
+    summary_id = Column(Integer, index=True)  # строка-итог в transactions
+    archived_at = Column(Timestamp, server_default=func.now())
+
+# Состояния FSM aiogram (fsm_storage.DatabaseStorage) - общие для всех воркеров
+class FsmState(Base):
+    __tablename__ = 'fsm_states'
+    
+    key = Column(String(200), primary_key=True)
+    state = Column(String(100), nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+
+# Сверка балансов (reconcile.py): баланс по истории до last_transaction_id включительно
+class BalanceCheckpoint(Base):
+    __tablename__ = 'balance_checkpoints'
+    
+    user_id = Column(BigInteger, primary_key=True)
+    last_transaction_id = Column(Integer, nullable=False)
+    last_created_at = Column(Timestamp, nullable=True)
+    balance = Column(Integer, nullable=False)
+    checked_at = Column(Timestamp, server_default=func.now())
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError, TelegramNetworkError
+
+from config import (NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE, NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_RATE,
+                    NOTIFY_CHAT_BURST, NOTIFY_MAX_RETRIES)
+
+logger = logging.getLogger(__name__)
+
+# Корзины чатов, простаивающие дольше этого времени, удаляются
+BUCKET_IDLE_TIMEOUT = 60
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Забирает токен; если его нет - возвращает, сколько секунд ждать"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Notice:
+    __slots__ = ('text', 'coalesce_key', 'delta', 'balance', 'attempts')
+
+    def __init__(self, text, coalesce_key=None, delta=None, balance=None):
+        self.text = text
+        self.coalesce_key = coalesce_key
+        self.delta = delta
+        self.balance = balance
+        self.attempts = 0
+
+    def render(self):
+        if self.delta is None:
+            return self.text
+        return self.text.format(delta=self.delta, balance=self.balance)
+
+
+class NotificationDispatcher:
+    """Очередь исходящих уведомлений с ограничением скорости.
+
+    Хэндлеры только ставят сообщение в очередь и сразу возвращаются.
+    Пул воркеров отправляет их с общим лимитом на бота и лимитом на чат,
+    выдерживает паузу по RetryAfter, а неотправленные уведомления о
+    балансе одного чата сливаются в одно сообщение.
+    """
+
+    def __init__(self, workers=NOTIFY_WORKERS, queue_size=NOTIFY_QUEUE_SIZE,
+                 global_rate=NOTIFY_GLOBAL_RATE, chat_rate=NOTIFY_CHAT_RATE,
+                 chat_burst=NOTIFY_CHAT_BURST, max_retries=NOTIFY_MAX_RETRIES):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}  # chat_id -> TokenBucket
+        self._pending = {}  # chat_id -> deque[Notice]
+        self._ready = asyncio.Queue()  # chat_id, у которых есть что отправить (каждый не больше одного раза)
+        self._scheduled = set()  # chat_id в очереди или ожидающие своего лимита
+        self._size = 0
+        self._paused_until = 0.0
+        self._bot = None
+        self._tasks = []
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return self._size
+
+    def send(self, chat_id: int, text: str, coalesce_key=None) -> bool:
+        """Ставит сообщение в очередь; с coalesce_key заменяет неотправленное с тем же ключом"""
+        return self._enqueue(chat_id, Notice(text, coalesce_key))
+
+    def send_balance(self, chat_id: int, delta: int, balance: int,
+                     template="🤖 Автокликер: +{delta}₽!\n💰 Баланс: {balance}₽",
+                     coalesce_key='balance') -> bool:
+        """Уведомление о начислении: несколько неотправленных суммируются в одно"""
+        return self._enqueue(chat_id, Notice(template, coalesce_key, delta, balance))
+
+    def _enqueue(self, chat_id: int, notice: Notice) -> bool:
+        queue = self._pending.get(chat_id)
+
+        if queue is not None and notice.coalesce_key is not None:
+            for pending in queue:
+                if pending.coalesce_key == notice.coalesce_key:
+                    if notice.delta is not None and pending.delta is not None:
+                        pending.delta += notice.delta
+                        pending.balance = notice.balance
+                    else:
+                        pending.text = notice.text
+                    self.coalesced += 1
+                    return True
+
+        if self._size >= self.queue_size:
+            self.dropped += 1
+            logger.warning("Очередь уведомлений переполнена, сообщение для %s отброшено", chat_id)
+            return False
+
+        if queue is None:
+            queue = self._pending[chat_id] = deque()
+        queue.append(notice)
+        self._size += 1
+        self._schedule(chat_id)
+        return True
+
+    def _schedule(self, chat_id: int):
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            self._ready.put_nowait(chat_id)
+
+    def _requeue_later(self, chat_id: int, delay: float):
+        # Чат ждёт свой лимит без участия воркера
+        asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.queue_size:
+                self._evict_idle_buckets(now)
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _evict_idle_buckets(self, now: float):
+        idle = [
+            chat_id for chat_id, bucket in self._chat_buckets.items()
+            if now - bucket.updated > BUCKET_IDLE_TIMEOUT and chat_id not in self._pending
+        ]
+        for chat_id in idle:
+            del self._chat_buckets[chat_id]
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._pending.get(chat_id)
+            if not queue:
+                self._scheduled.discard(chat_id)
+                self._pending.pop(chat_id, None)
+                continue
+
+            now = time.monotonic()
+            wait = self._chat_bucket(chat_id, now).take(now)
+            if wait > 0:
+                self._requeue_later(chat_id, wait)
+                continue
+
+            # Общий лимит бота и пауза после RetryAfter касаются всех чатов
+            while True:
+                now = time.monotonic()
+                wait = max(self._paused_until - now, self._global_bucket.take(now))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            notice = queue.popleft()
+            self._size -= 1
+            retry_delay = await self._deliver(chat_id, notice)
+
+            if retry_delay is not None and notice.attempts <= self.max_retries:
+                queue.appendleft(notice)
+                self._size += 1
+                self._requeue_later(chat_id, retry_delay)
+            elif queue:
+                # Остальные сообщения чата - в конец очереди, чтобы не задерживать другие чаты
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._pending[chat_id]
+                self._scheduled.discard(chat_id)
+
+    async def _deliver(self, chat_id: int, notice: Notice):
+        """Отправляет сообщение; возвращает задержку до повтора или None"""
+        notice.attempts += 1
+        try:
+            await self._bot.send_message(chat_id, notice.render())
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            logger.warning("Telegram просит подождать %s с", e.retry_after)
+            self._paused_until = time.monotonic() + e.retry_after
+            return e.retry_after
+        except TelegramNetworkError as e:
+            logger.warning("Сетевая ошибка при отправке уведомления %s: %s", chat_id, e)
+            return 2 ** notice.attempts
+        except TelegramAPIError as e:
+            # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+            logger.info("Уведомление для %s не доставлено: %s", chat_id, e)
+        except Exception:
+            logger.exception("Ошибка при отправке уведомления %s", chat_id)
+        return None
+
+    def start(self, bot):
+        self._bot = bot
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=5.0):
+        """Даёт очереди досылаться до timeout секунд и останавливает воркеры"""
+        deadline = time.monotonic() + timeout
+        while self._size and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+notifier = NotificationDispatcher()
@@ -0,0 +1,199 @@
+"""Защита от флуда: лимит частоты на пользователя и общий лимит одновременной работы с БД.
+
+Лишний запрос отбрасывается до открытия сессии БД: в боте - внешним middleware
+на update перед DbSessionMiddleware, в API Mini App - middleware после проверки initData.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from notifications import notifier
+from config import (RATE_LIMIT_ENABLED, RATE_LIMITS, RATE_LIMIT_MAX_USERS,
+                    RATE_LIMIT_CONCURRENCY, RATE_LIMIT_QUEUE_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+CLICK_TEXT = "🖱 Кликнуть +10₽"
+TOO_MANY = "⏳ Слишком часто, подождите немного"
+BUSY = "⏳ Сервер перегружен, попробуйте ещё раз"
+
+# Маршруты API со своим лимитом, остальные /api/ - общий 'api'
+ROUTE_ACTIONS = {
+    '/api/transfer': 'transfer',
+    '/api/export': 'export',
+}
+# Долгие ответы: место в лимите одновременности не держат. /api/events не работает с БД,
+# /api/export берёт место сам на время чтения каждой порции
+UNSLOTTED_ROUTES = {'/api/events', '/api/export'}
+
+
+class RateLimiter:
+    """Token bucket на пользователя в форме GCRA.
+
+    Для ведра хранится одно число - момент, когда оно снова наполнится.
+    Ведро, которое уже наполнилось, ничем не отличается от отсутствующего,
+    поэтому при каждом обращении из начала OrderedDict (давно не трогали)
+    удаляются наполнившиеся вёдра: память занимают только активные пользователи.
+    """
+
+    def __init__(self, limits=RATE_LIMITS, max_users=RATE_LIMIT_MAX_USERS,
+                 concurrency=RATE_LIMIT_CONCURRENCY, enabled=RATE_LIMIT_ENABLED):
+        self.enabled = enabled
+        self.max_users = max_users
+        # действие -> (секунд на один запрос, сколько секунд "в долг" помещается в ведро)
+        self._limits = {action: (1 / rate, burst / rate) for action, (rate, burst) in limits.items()}
+        self._buckets = {action: OrderedDict() for action in limits}  # user_id -> момент наполнения
+        self._slots = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.active = 0
+        self.waiting = 0
+        self.rejected = {action: 0 for action in limits}
+        self.overloaded = {'http': 0, 'bot': 0}  # не дождались места: запросы API и апдейты бота
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+    def hit(self, action: str, user_id: int, now=None) -> float:
+        """Учитывает запрос: 0 - пропустить, иначе через сколько секунд повторить"""
+        if not self.enabled:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        interval, capacity = self._limits[action]
+        buckets = self._buckets[action]
+
+        full_at = max(buckets.get(user_id, now), now) + interval
+        if full_at - now > capacity:
+            self.rejected[action] += 1
+            return full_at - now - capacity
+
+        buckets[user_id] = full_at
+        buckets.move_to_end(user_id)
+        self._evict(buckets, now)
+        return 0.0
+
+    def _evict(self, buckets, now: float):
+        while buckets:
+            user_id, full_at = next(iter(buckets.items()))
+            # Переполнение: забытое ведро считается полным - это лишь мягче к пользователю
+            if full_at > now and len(buckets) <= self.max_users:
+                break
+            del buckets[user_id]
+
+    async def acquire(self, timeout=None, source='http') -> bool:
+        """Место среди одновременных обработчиков; False, если не дождались за timeout.
+
+        source - 'http' или 'bot', для счётчика отказов overloaded.
+        """
+        self.waiting += 1
+        try:
+            if timeout is None:
+                await self._slots.acquire()
+            else:
+                await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.overloaded[source] += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            'buckets': len(self),
+            'active': self.active,
+            'waiting': self.waiting,
+            'overloaded': dict(self.overloaded),
+            'rejected': dict(self.rejected)
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+def update_action(update: Update):
+    """Действие апдейта и его автор; (None, None) - апдейт не ограничивается"""
+    if update.message is not None and update.message.from_user is not None:
+        action = 'click' if update.message.text == CLICK_TEXT else 'message'
+        return action, update.message.from_user.id
+    if update.callback_query is not None:
+        return 'callback', update.callback_query.from_user.id
+    return None, None
+
+
+class BotRateLimitMiddleware(BaseMiddleware):
+    """Внешний middleware на update: подключается раньше DbSessionMiddleware.
+
+    Апдейт сверх лимита не доходит до хэндлеров и не открывает сессию БД,
+    пользователь изредка получает предупреждение. Остальные ждут место
+    в общем лимите одновременности не дольше RATE_LIMIT_QUEUE_TIMEOUT,
+    как и API: иначе отвечаем "попробуйте ещё раз" и апдейт пропускаем.
+    """
+
+    def __init__(self, limiter=rate_limiter):
+        self.limiter = limiter
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        action, user_id = update_action(event)
+        if action is not None and self.limiter.hit(action, user_id):
+            if not self.limiter.hit('notice', user_id):
+                await self._warn(event, data['bot'], TOO_MANY)
+            return None
+
+        if not await self.limiter.acquire(RATE_LIMIT_QUEUE_TIMEOUT, source='bot'):
+            if action is not None and not self.limiter.hit('notice', user_id):
+                await self._warn(event, data['bot'], BUSY)
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            self.limiter.release()
+
+    async def _warn(self, update: Update, bot, text: str):
+        if update.callback_query is not None:
+            try:
+                await bot.answer_callback_query(update.callback_query.id, text)
+            except Exception:
+                logger.warning("Не удалось ответить на callback %s", update.callback_query.id)
+        else:
+            notifier.send(update.message.chat.id, text, coalesce_key='rate_limit')
+
+
+@web.middleware
+async def http_middleware(request, handler):
+    """Лимиты API Mini App: после auth_middleware, пользователь уже в request"""
+    user_id = request.get('user_id')
+    if user_id is None:
+        return await handler(request)
+
+    action = ROUTE_ACTIONS.get(request.path, 'api')
+    retry_after = rate_limiter.hit(action, user_id)
+    if retry_after:
+        return web.json_response({'error': 'Too many requests'}, status=429,
+                                 headers={'Retry-After': str(math.ceil(retry_after))})
+
+    if request.path in UNSLOTTED_ROUTES:
+        return await handler(request)
+    if not await rate_limiter.acquire(RATE_LIMIT_QUEUE_TIMEOUT):
+        return web.json_response({'error': 'Server is busy'}, status=503, headers={'Retry-After': '1'})
+    try:
+        return await handler(request)
+    finally:
+        rate_limiter.release()
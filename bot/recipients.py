@@ -0,0 +1,143 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from sqlalchemy import select, update, func, exists
+from sqlalchemy.orm import aliased
+
+from models import User
+from balance_cache import balance_cache
+from config import RECIPIENT_CACHE_SIZE, RECIPIENT_CACHE_TTL, RECIPIENT_NEGATIVE_TTL
+
+
+class Recipient(NamedTuple):
+    user_id: int
+    username: str
+    first_name: str
+
+
+def normalize_username(text: str):
+    """'@UserName ' -> 'username' (usernames в Telegram без учёта регистра)"""
+    return text.strip().lstrip('@').lower()
+
+
+def release_duplicate_usernames():
+    """Снимает повторяющиеся без учёта регистра usernames, кроме самого нового владельца.
+
+    Нужно перед созданием уникального индекса на старой базе: имя могло
+    перейти к другому пользователю, а у прежнего остаться записанным.
+    """
+    other = aliased(User)
+    return update(User).where(
+        User.username.is_not(None),
+        exists().where(
+            func.lower(other.username) == func.lower(User.username),
+            (other.registered_at > User.registered_at)
+            | ((other.registered_at == User.registered_at) & (other.user_id > User.user_id))
+        )
+    ).values(username=None)
+
+
+class RecipientResolver:
+    """Поиск получателя перевода по @username или user_id.
+
+    Username ищется по уникальному индексу lower(username). Найденные
+    получатели и ненайденные имена кэшируются; ненайденное имя живёт
+    в кэше недолго, а регистрация в /start сразу его вытесняет.
+    """
+
+    def __init__(self, size=RECIPIENT_CACHE_SIZE, ttl=RECIPIENT_CACHE_TTL,
+                 negative_ttl=RECIPIENT_NEGATIVE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # username -> (Recipient или None, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, session, text: str):
+        """Получатель по тексту пользователя или None"""
+        text = text.strip()
+        if text.isdigit():
+            user = await balance_cache.load(session, int(text))
+            return Recipient(user.user_id, user.username, user.first_name) if user else None
+
+        username = normalize_username(text)
+        if not username:
+            return None
+
+        entry = self._entries.get(username)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        row = (await session.execute(
+            select(User.user_id, User.username, User.first_name)
+            .where(func.lower(User.username) == username)
+        )).first()
+        recipient = Recipient(*row) if row else None
+        self._put(username, recipient)
+        return recipient
+
+    async def search(self, session, prefix: str, limit: int = 10, exclude=None):
+        """Пользователи, чей username начинается с prefix - диапазон по индексу, без LIKE"""
+        prefix = normalize_username(prefix)
+        if not prefix:
+            return []
+
+        username = func.lower(User.username)
+        query = (
+            select(User.user_id, User.username, User.first_name)
+            .where(username >= prefix, username < prefix + '\uffff')
+            .order_by(username)
+            .limit(limit)
+        )
+        if exclude is not None:
+            query = query.where(User.user_id != exclude)
+        return [Recipient(*row) for row in (await session.execute(query)).all()]
+
+    async def claim_username(self, session, user_id: int, username):
+        """Закрепляет username за user_id (в транзакции сессии).
+
+        Telegram гарантирует уникальность только текущих usernames: если имя
+        осталось записанным за другим пользователем, у того оно снимается.
+        """
+        if username:
+            result = await session.execute(
+                update(User)
+                .where(func.lower(User.username) == username.lower(), User.user_id != user_id)
+                .values(username=None)
+                .returning(User.user_id)
+            )
+            for previous_owner in result.scalars():
+                balance_cache.invalidate(previous_owner)
+
+    def register(self, user_id: int, username, first_name, old_username=None):
+        """Обновляет кэш после регистрации или смены username в /start"""
+        if old_username:
+            self._entries.pop(old_username.lower(), None)
+        if username:
+            self._put(username.lower(), Recipient(user_id, username, first_name))
+
+    def _put(self, username: str, recipient):
+        ttl = self.ttl if recipient is not None else self.negative_ttl
+        if self.size <= 0 or ttl <= 0:
+            return
+        self._entries[username] = (recipient, time.monotonic() + ttl)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0
+        }
+
+
+recipient_resolver = RecipientResolver()
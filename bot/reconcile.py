@@ -0,0 +1,210 @@
+"""Сверка users.balance с историей транзакций.
+
+Для каждого пользователя хранится контрольная точка (balance_checkpoints):
+баланс по истории до last_transaction_id включительно. Проход сверки
+досчитывает к ней только более новые строки, сравнивает результат
+с users.balance и сдвигает точку вперёд, если расхождения нет. Пользователь
+без точки пересчитывается по всей истории.
+
+Дневные итоги кликов (click_summary) при досчёте пропускаются: compaction.py
+сворачивает только строки, уже вошедшие в точку, и итог заменяет их, а не
+добавляет новые деньги. Точка не сдвигается на строки моложе RECONCILE_SETTLE
+секунд - более ранний id может быть ещё не закоммичен.
+
+Запуск: python bot/reconcile.py [--full]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, func, literal, or_, false
+
+from database import AsyncSessionLocal, UPSERT, init_db
+from models import User, Transaction, BalanceCheckpoint, SYSTEM_USER_ID
+from config import RECONCILE_INTERVAL, RECONCILE_BATCH, RECONCILE_SETTLE
+
+logger = logging.getLogger(__name__)
+
+users = User.__table__
+transactions = Transaction.__table__
+checkpoints = BalanceCheckpoint.__table__
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _ledger_query(after: int, limit: int, settle_before: datetime, full: bool):
+    """Баланс и досчёт истории для пачки пользователей одним запросом (один снимок БД)"""
+    if full:
+        has_checkpoint = false()
+        start_balance = literal(0)
+        last_id = literal(0)
+        last_at = literal(EPOCH, Transaction.created_at.type)
+    else:
+        has_checkpoint = checkpoints.c.user_id.is_not(None)
+        start_balance = func.coalesce(checkpoints.c.balance, 0)
+        last_id = func.coalesce(checkpoints.c.last_transaction_id, 0)
+        last_at = func.coalesce(checkpoints.c.last_created_at, EPOCH)
+
+    def tail(column, value, settled=False):
+        # created_at >= last_at даёт диапазон по индексу (пользователь, created_at)
+        query = select(value).where(
+            column == users.c.user_id,
+            transactions.c.created_at >= last_at,
+            transactions.c.id > last_id,
+            or_(~has_checkpoint, transactions.c.type != 'click_summary')
+        )
+        if settled:
+            query = query.where(transactions.c.created_at < settle_before)
+        return query.scalar_subquery()
+
+    columns = [users.c.user_id, users.c.balance, start_balance]
+    for column in (transactions.c.to_user_id, transactions.c.from_user_id):
+        columns += [
+            tail(column, func.coalesce(func.sum(transactions.c.amount), 0)),
+            tail(column, func.coalesce(func.sum(transactions.c.amount), 0), settled=True),
+            tail(column, func.max(transactions.c.id), settled=True),
+            tail(column, func.max(transactions.c.created_at), settled=True),
+        ]
+
+    query = (
+        select(*columns)
+        .where(users.c.user_id > after, users.c.user_id != SYSTEM_USER_ID)
+        .order_by(users.c.user_id)
+        .limit(limit)
+    )
+    if not full:
+        query = query.select_from(
+            users.outerjoin(checkpoints, checkpoints.c.user_id == users.c.user_id)
+        ).add_columns(checkpoints.c.last_transaction_id, checkpoints.c.last_created_at)
+    else:
+        query = query.add_columns(literal(None), literal(None))
+    return query
+
+
+def _latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+async def reconcile(full=False, batch=RECONCILE_BATCH, settle=RECONCILE_SETTLE,
+                    session_pool=AsyncSessionLocal):
+    """Один проход сверки по всем пользователям, возвращает отчёт.
+
+    full=True игнорирует контрольные точки и пересчитывает всю историю.
+    """
+    started = time.perf_counter()
+    report = {'users': 0, 'checkpointed': 0, 'drift': []}
+    after = -1
+
+    while True:
+        settle_before = datetime.now(timezone.utc) - timedelta(seconds=settle)
+        async with session_pool() as session:
+            rows = (await session.execute(_ledger_query(after, batch, settle_before, full))).all()
+        if not rows:
+            break
+        after = rows[-1][0]
+        report['users'] += len(rows)
+
+        advanced = []
+        for (user_id, balance, start_balance,
+             credit, settled_credit, credit_id, credit_at,
+             debit, settled_debit, debit_id, debit_at,
+             checkpoint_id, checkpoint_at) in rows:
+            ledger = start_balance + credit - debit
+            if balance != ledger:
+                report['drift'].append((user_id, balance, ledger))
+                logger.warning("Баланс %d расходится с историей: %d в users, %d по транзакциям (%+d)",
+                               user_id, balance, ledger, balance - ledger)
+                continue
+
+            new_id = _latest(credit_id, debit_id)
+            if new_id is None and checkpoint_id is not None:
+                continue
+            advanced.append({
+                'user_id': user_id,
+                'last_transaction_id': _latest(new_id, checkpoint_id) or 0,
+                'last_created_at': _latest(credit_at, debit_at, checkpoint_at),
+                'balance': start_balance + settled_credit - settled_debit,
+                'checked_at': datetime.now(timezone.utc)
+            })
+
+        # Запись отдельной транзакцией: чтение выше не держит снимок БД, пока ждём блокировку
+        if advanced:
+            async with session_pool() as session:
+                statement = UPSERT[session.bind.dialect.name](checkpoints)
+                await session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=[checkpoints.c.user_id],
+                        set_={name: statement.excluded[name] for name in
+                              ('last_transaction_id', 'last_created_at', 'balance', 'checked_at')}
+                    ),
+                    advanced
+                )
+                await session.commit()
+            report['checkpointed'] += len(advanced)
+
+    report['elapsed'] = time.perf_counter() - started
+    return report
+
+
+class Reconciler:
+    """Периодическая сверка в фоне (в main.py, только на основном воркере)"""
+
+    def __init__(self, interval=RECONCILE_INTERVAL):
+        self.interval = interval
+        self.last_report = None
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_report = report = await reconcile()
+            except Exception:
+                logger.exception("Сверка балансов не выполнена")
+                continue
+            log = logger.warning if report['drift'] else logger.info
+            log("Сверка: %d пользователей, расхождений %d, точек обновлено %d за %.2fс",
+                report['users'], len(report['drift']), report['checkpointed'], report['elapsed'])
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+reconciler = Reconciler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--full', action='store_true', help="пересчитать всю историю, не глядя на точки")
+    parser.add_argument('--batch', type=int, default=RECONCILE_BATCH, help="пользователей за запрос")
+    args = parser.parse_args()
+
+    async def run():
+        # Таблица контрольных точек появляется при первом запуске после обновления
+        await init_db()
+        return await reconcile(full=args.full, batch=args.batch)
+
+    logging.basicConfig(level=logging.INFO)
+    report = asyncio.run(run())
+    print(f"Проверено {report['users']} пользователей за {report['elapsed']:.2f}с, "
+          f"контрольных точек обновлено: {report['checkpointed']}")
+    if report['drift']:
+        print(f"Расхождения ({len(report['drift'])}):")
+        for user_id, balance, ledger in report['drift']:
+            print(f"  {user_id}: users.balance={balance}, по истории={ledger} ({balance - ledger:+d})")
+        sys.exit(1)
+    print("Расхождений нет")
@@ -0,0 +1,67 @@
+from sqlalchemy import select, update, func
+
+from models import User, Transaction
+
+users = User.__table__
+transactions = Transaction.__table__
+
+# Колонки, которые меняет каждая запись в историю: их возвращают через RETURNING
+# и сразу кладут в кэш балансов
+LEDGER_COLUMNS = (
+    users.c.user_id,
+    users.c.balance,
+    users.c.tx_count,
+    users.c.total_in,
+    users.c.total_out,
+    users.c.last_activity_at
+)
+
+
+def credit_values(amount, count=1):
+    """Значения для UPDATE users при зачислении amount (count записей в истории)"""
+    return {
+        'balance': users.c.balance + amount,
+        'tx_count': users.c.tx_count + count,
+        'total_in': users.c.total_in + amount,
+        'last_activity_at': func.now()
+    }
+
+
+def debit_values(amount):
+    """Значения для UPDATE users при списании amount (одна запись в истории)"""
+    return {
+        'balance': users.c.balance - amount,
+        'tx_count': users.c.tx_count + 1,
+        'total_out': users.c.total_out + amount,
+        'last_activity_at': func.now()
+    }
+
+
+def rebuild_user_stats():
+    """Пересчёт счётчиков всех пользователей по истории транзакций агрегатами SQL"""
+    uid = users.c.user_id
+    incoming = (transactions.c.to_user_id == uid) & (transactions.c.from_user_id != uid)
+    outgoing = (transactions.c.from_user_id == uid) & (transactions.c.to_user_id != uid)
+
+    return update(users).values(
+        tx_count=select(func.count()).where(
+            (transactions.c.from_user_id == uid) | (transactions.c.to_user_id == uid)
+        ).scalar_subquery(),
+        total_in=select(func.coalesce(func.sum(transactions.c.amount), 0))
+        .where(incoming).scalar_subquery(),
+        total_out=select(func.coalesce(func.sum(transactions.c.amount), 0))
+        .where(outgoing).scalar_subquery(),
+        last_activity_at=select(func.max(transactions.c.created_at)).where(
+            (transactions.c.from_user_id == uid) | (transactions.c.to_user_id == uid)
+        ).scalar_subquery()
+    )
+
+
+def user_stats(user: User):
+    """Статистика из уже загруженной строки users - без обращения к transactions"""
+    return {
+        'transactions_count': user.tx_count,
+        'total_in': user.total_in,
+        'total_out': user.total_out,
+        'last_activity_at': user.last_activity_at.isoformat() if user.last_activity_at else None
+    }
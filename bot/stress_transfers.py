@@ -0,0 +1,114 @@
+"""Стресс-проверка переводов: много корутин одновременно списывают с одного счёта.
+
+Проверяет, что денежная масса сохраняется, баланс не уходит в минус,
+а баланс каждого пользователя совпадает с его историей транзакций.
+
+Запуск: python bot/stress_transfers.py [корутин] [переводов на корутину]
+Работает на временной базе, bank.db не трогает.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event, insert, select, func
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import Base, AsyncSessionLocal, _set_sqlite_pragmas
+from models import User, Transaction
+from transfers import transfer, InsufficientFunds
+from ledger_writer import ledger_writer
+
+HOT_USER = 1
+USERS = 20
+INITIAL_BALANCE = 1000
+
+
+async def seed():
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await session.execute(insert(User), [
+                {'user_id': i, 'first_name': f'User {i}', 'balance': INITIAL_BALANCE}
+                for i in range(1, USERS + 1)
+            ])
+
+
+async def worker(n: int, stats: dict):
+    for _ in range(n):
+        # Половина переводов - с "горячего" счёта, остальные - встречные и случайные
+        if random.random() < 0.5:
+            sender = HOT_USER
+        else:
+            sender = random.randint(1, USERS)
+        recipient = random.choice([i for i in range(1, USERS + 1) if i != sender])
+        amount = random.randint(1, 150)
+
+        try:
+            await transfer(sender, recipient, amount, description="stress")
+            stats['ok'] += 1
+        except InsufficientFunds:
+            stats['rejected'] += 1
+
+
+async def check():
+    errors = []
+    async with AsyncSessionLocal() as session:
+        balances = dict((await session.execute(select(User.user_id, User.balance))).all())
+
+        incoming = dict((await session.execute(
+            select(Transaction.to_user_id, func.sum(Transaction.amount)).group_by(Transaction.to_user_id)
+        )).all())
+        outgoing = dict((await session.execute(
+            select(Transaction.from_user_id, func.sum(Transaction.amount)).group_by(Transaction.from_user_id)
+        )).all())
+
+    total = sum(balances.values())
+    if total != USERS * INITIAL_BALANCE:
+        errors.append(f"денежная масса {total} != {USERS * INITIAL_BALANCE}")
+
+    for user_id, balance in balances.items():
+        if balance < 0:
+            errors.append(f"пользователь {user_id}: отрицательный баланс {balance}")
+        expected = INITIAL_BALANCE + incoming.get(user_id, 0) - outgoing.get(user_id, 0)
+        if balance != expected:
+            errors.append(f"пользователь {user_id}: баланс {balance}, по истории {expected}")
+
+    return errors
+
+
+async def main(workers: int, per_worker: int):
+    path = os.path.join(tempfile.mkdtemp(prefix="bank_stress_"), "bank.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=10, max_overflow=20,
+                                 connect_args={'timeout': 5})
+    event.listen(engine.sync_engine, "connect", _set_sqlite_pragmas)
+    AsyncSessionLocal.configure(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await seed()
+
+    stats = {'ok': 0, 'rejected': 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(per_worker, stats) for _ in range(workers)))
+    elapsed = time.perf_counter() - started
+
+    total = workers * per_worker
+    print(f"{total} переводов за {elapsed:.2f}с ({total / elapsed:.0f}/с): "
+          f"выполнено {stats['ok']}, отклонено {stats['rejected']}")
+    await ledger_writer.stop()
+    writes = ledger_writer.stats()
+    print(f"транзакций БД: {writes['batches']}, в среднем {writes['per_batch']:.1f} переводов в каждой")
+
+    errors = await check()
+    if errors:
+        for error in errors:
+            print("FAIL:", error)
+        sys.exit(1)
+    print("OK: денежная масса сохранена, балансы сходятся с историей")
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_worker = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    asyncio.run(main(workers, per_worker))
@@ -0,0 +1,102 @@
+"""Запуск бота в несколько процессов.
+
+Создаёт схему БД и запускает WORKERS копий main.py. Все воркеры слушают
+порт Mini App через SO_REUSEPORT и принимают вебхук, воркер 0 дополнительно
+ведёт автокликер и устанавливает вебхук (или читает getUpdates в режиме polling).
+Упавший воркер перезапускается.
+
+Запуск: WORKERS=4 BOT_MODE=webhook WEBHOOK_SECRET=... python bot/supervisor.py
+Для общего состояния нужны FSM_STORAGE=db или file (по умолчанию db при WORKERS > 1).
+"""
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from config import WORKERS, BOT_MODE, FSM_STORAGE, WEBHOOK_SECRET
+from database import init_db
+import models  # noqa: F401 - регистрирует таблицы для create_all
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("supervisor")
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+RESTART_DELAY = 1.0  # секунды, растёт вдвое при частых падениях
+MAX_RESTART_DELAY = 30.0
+STABLE_AFTER = 60  # воркер, проработавший столько секунд, перезапускается без задержки
+
+
+class Supervisor:
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self._processes = {}  # worker_id -> Popen
+        self._started_at = {}  # worker_id -> время запуска
+        self._restart_at = {}  # worker_id -> время ближайшего перезапуска
+        self._delay = {}  # worker_id -> текущая задержка перезапуска
+        self._stopping = False
+
+    def _spawn(self, worker_id: int):
+        env = dict(os.environ, WORKER_ID=str(worker_id), WORKERS=str(self.workers))
+        # Своя группа процессов: Ctrl+C из терминала получает только супервизор и рассылает сам
+        self._processes[worker_id] = subprocess.Popen([sys.executable, MAIN], env=env, start_new_session=True)
+        self._started_at[worker_id] = time.monotonic()
+        self._restart_at.pop(worker_id, None)
+        logger.info("Воркер %d запущен (pid %d)", worker_id, self._processes[worker_id].pid)
+
+    def _check(self):
+        now = time.monotonic()
+        for worker_id, process in list(self._processes.items()):
+            code = process.poll()
+            if code is None or worker_id in self._restart_at:
+                continue
+            if now - self._started_at[worker_id] > STABLE_AFTER:
+                self._delay[worker_id] = RESTART_DELAY
+            delay = self._delay.get(worker_id, RESTART_DELAY)
+            logger.warning("Воркер %d завершился с кодом %s, перезапуск через %.0fс", worker_id, code, delay)
+            self._restart_at[worker_id] = now + delay
+            self._delay[worker_id] = min(delay * 2, MAX_RESTART_DELAY)
+
+        for worker_id, restart_at in list(self._restart_at.items()):
+            if restart_at <= now:
+                self._spawn(worker_id)
+
+    def stop(self, *args):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+        while not self._stopping:
+            time.sleep(0.5)
+            self._check()
+
+        # Воркеры сами дописывают клики и дожидаются начатых апдейтов
+        for process in self._processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for worker_id, process in self._processes.items():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                logger.warning("Воркер %d не остановился, завершаем принудительно", worker_id)
+                process.kill()
+
+
+if __name__ == "__main__":
+    if WORKERS > 1 and FSM_STORAGE == 'memory':
+        logger.warning("FSM_STORAGE=memory: диалог перевода не переживёт переход между воркерами")
+    if BOT_MODE == 'webhook' and not WEBHOOK_SECRET:
+        sys.exit("Режим вебхука требует WEBHOOK_SECRET")
+    if WORKERS > 1 and BOT_MODE != 'webhook':
+        logger.info("Режим polling: апдейты читает только воркер 0")
+
+    # Схема создаётся один раз до запуска воркеров
+    asyncio.run(init_db())
+    Supervisor().run()
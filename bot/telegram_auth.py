@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+from config import BOT_TOKEN, INIT_DATA_MAX_AGE, INIT_DATA_CACHE_SIZE, INIT_DATA_CACHE_TTL
+
+
+class InitDataVerifier:
+    """Проверка initData Telegram Mini App с кэшем проверенных строк.
+
+    Секрет WebAppData считается один раз. Успешно проверенные строки
+    хранятся в LRU-кэше до истечения auth_date + max_age, поэтому повторные
+    запросы той же сессии Mini App не парсятся и не хэшируются заново.
+    """
+
+    def __init__(self, bot_token=BOT_TOKEN, max_age=INIT_DATA_MAX_AGE,
+                 cache_size=INIT_DATA_CACHE_SIZE, cache_ttl=INIT_DATA_CACHE_TTL):
+        self.secret_key = hmac.new(
+            b"WebAppData",
+            (bot_token or "").encode(),
+            hashlib.sha256
+        ).digest()
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+        # Ключ - вся строка initData целиком: одного hash недостаточно,
+        # иначе к чужому hash можно было бы подставить другие поля
+        self._cache = OrderedDict()  # init_data -> (identity, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, init_data: str):
+        """Возвращает {'user_id', 'user', 'auth_date'} или None, если данные не подлинные"""
+        if not init_data:
+            return None
+
+        now = time.time()
+        cached = self._cache.get(init_data)
+        if cached is not None:
+            identity, expires_at = cached
+            if expires_at > now:
+                self._cache.move_to_end(init_data)
+                self.hits += 1
+                return identity
+            del self._cache[init_data]
+
+        self.misses += 1
+        identity = self._verify(init_data, now)
+        if identity is not None and self.cache_size > 0:
+            if self.max_age:
+                expires_at = identity['auth_date'] + self.max_age
+            else:
+                expires_at = now + self.cache_ttl
+            self._cache[init_data] = (identity, expires_at)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return identity
+
+    def _verify(self, init_data: str, now: float):
+        try:
+            parsed_data = dict(parse_qsl(init_data, keep_blank_values=True))
+
+            hash_str = parsed_data.pop("hash", "")
+            data_check_string = "\n".join(
+                f"{key}={value}"
+                for key, value in sorted(parsed_data.items())
+            )
+
+            calculated_hash = hmac.new(
+                self.secret_key,
+                data_check_string.encode(),
+                hashlib.sha256
+            ).hexdigest()
+
+            if not hmac.compare_digest(calculated_hash, hash_str):
+                return None
+
+            auth_date = int(parsed_data.get("auth_date", 0))
+            if self.max_age and now - auth_date > self.max_age:
+                return None
+
+            user = json.loads(parsed_data["user"])
+            return {
+                'user_id': int(user['id']),
+                'user': user,
+                'auth_date': auth_date
+            }
+        except (KeyError, ValueError, TypeError):
+            return None
@@ -0,0 +1,167 @@
+from typing import NamedTuple
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+
+from database import AsyncSessionLocal
+from models import User, Transaction, SYSTEM_USER_ID
+from stats import credit_values, debit_values, LEDGER_COLUMNS
+from events import event_hub
+from idempotency import IdempotencyConflict
+from ledger_writer import ledger_writer, write_through
+
+users = User.__table__
+
+
+class TransferError(Exception):
+    """Перевод не выполнен; текст исключения можно показать пользователю"""
+
+
+class InvalidAmount(TransferError):
+    def __init__(self):
+        super().__init__("Сумма должна быть положительной")
+
+
+class SelfTransfer(TransferError):
+    def __init__(self):
+        super().__init__("Нельзя перевести самому себе")
+
+
+class SenderNotFound(TransferError):
+    def __init__(self):
+        super().__init__("Отправитель не найден")
+
+
+class RecipientNotFound(TransferError):
+    def __init__(self):
+        super().__init__("Получатель не найден")
+
+
+class InsufficientFunds(TransferError):
+    def __init__(self, balance: int):
+        self.balance = balance
+        super().__init__(f"Недостаточно средств. Ваш баланс: {balance}₽")
+
+
+class TransferResult(NamedTuple):
+    transaction_id: int
+    sender_balance: int
+    recipient_balance: int
+    replayed: bool = False  # перевод с этим ключом уже был выполнен раньше
+    rows: tuple = ()  # новые строки users (LEDGER_COLUMNS) для кэша балансов
+
+
+async def _debit(session, user_id: int, amount: int):
+    # Условное списание: проверка баланса и запись в одном UPDATE, без гонки чтение-запись
+    result = await session.execute(
+        update(users)
+        .where(users.c.user_id == user_id, users.c.balance >= amount)
+        .values(**debit_values(amount))
+        .returning(*LEDGER_COLUMNS)
+    )
+    row = result.one_or_none()
+    if row is None:
+        current = await session.scalar(select(users.c.balance).where(users.c.user_id == user_id))
+        if current is None:
+            raise SenderNotFound()
+        raise InsufficientFunds(current)
+    return row
+
+
+async def _credit(session, user_id: int, amount: int):
+    result = await session.execute(
+        update(users)
+        .where(users.c.user_id == user_id)
+        .values(**credit_values(amount))
+        .returning(*LEDGER_COLUMNS)
+    )
+    row = result.one_or_none()
+    if row is None:
+        raise RecipientNotFound()
+    return row
+
+
+async def execute_transfer(session, sender_id: int, recipient_id: int, amount: int,
+                           description: str, idempotency_key=None):
+    """Перевод внутри уже открытой транзакции сессии; при ошибке её (или точку сохранения) нужно откатить"""
+    if amount <= 0:
+        raise InvalidAmount()
+    if sender_id == recipient_id:
+        raise SelfTransfer()
+    if recipient_id == SYSTEM_USER_ID:
+        raise RecipientNotFound()
+
+    # Строки блокируем в порядке user_id, чтобы встречные переводы
+    # не взаимоблокировались на БД с построчными блокировками
+    if sender_id < recipient_id:
+        sender = await _debit(session, sender_id, amount)
+        recipient = await _credit(session, recipient_id, amount)
+    else:
+        recipient = await _credit(session, recipient_id, amount)
+        sender = await _debit(session, sender_id, amount)
+
+    result = await session.execute(
+        insert(Transaction)
+        .values(
+            from_user_id=sender_id,
+            to_user_id=recipient_id,
+            amount=amount,
+            type='transfer',
+            description=description,
+            idempotency_key=idempotency_key
+        )
+        .returning(Transaction.id)
+    )
+
+    return TransferResult(result.scalar_one(), sender.balance, recipient.balance,
+                          rows=(sender, recipient))
+
+
+async def find_replayed_transfer(sender_id: int, recipient_id: int, amount: int, idempotency_key: str):
+    """Ранее выполненный перевод с тем же ключом (уникальный индекс по отправителю и ключу)"""
+    async with AsyncSessionLocal() as session:
+        existing = (await session.execute(
+            select(Transaction.id, Transaction.to_user_id, Transaction.amount)
+            .where(Transaction.from_user_id == sender_id,
+                   Transaction.idempotency_key == idempotency_key)
+        )).first()
+        if existing is None:
+            return None
+        if existing.to_user_id != recipient_id or existing.amount != amount:
+            raise IdempotencyConflict()
+
+        balances = dict((await session.execute(
+            select(users.c.user_id, users.c.balance)
+            .where(users.c.user_id.in_((sender_id, recipient_id)))
+        )).all())
+
+    return TransferResult(existing.id, balances.get(sender_id), balances.get(recipient_id), replayed=True)
+
+
+async def transfer(sender_id: int, recipient_id: int, amount: int, description: str,
+                   idempotency_key=None):
+    """Атомарный перевод: выполняется в общей транзакции ledger_writer в своей точке сохранения.
+
+    С idempotency_key повторный вызов не переводит деньги второй раз,
+    а возвращает уже выполненный перевод (replayed=True).
+    """
+    def committed(result):
+        # В кэш, рейтинг и открытым вкладкам Mini App - только после коммита
+        write_through(result.rows)
+        event_hub.publish(recipient_id, 'transfer', transaction_id=result.transaction_id,
+                          from_user_id=sender_id, amount=amount, description=description,
+                          balance=result.recipient_balance)
+
+    try:
+        return await ledger_writer.submit(
+            lambda session: execute_transfer(session, sender_id, recipient_id, amount, description,
+                                             idempotency_key=idempotency_key),
+            on_commit=committed
+        )
+    except IntegrityError:
+        # Перевод с этим ключом уже зафиксирован - откатилась только эта операция
+        if idempotency_key is None:
+            raise
+        replayed = await find_replayed_transfer(sender_id, recipient_id, amount, idempotency_key)
+        if replayed is None:
+            raise
+        return replayed
@@ -1,269 +1,753 @@
-from aiohttp import web
-import aiohttp
-from datetime import datetime
-import json
-import hmac
-import hashlib
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
-import asyncio
-
-from database import AsyncSessionLocal
-from models import User, Transaction
-from config import WEBAPP_HOST, WEBAPP_PORT, BOT_TOKEN
-
-class WebAppServer:
-    def __init__(self):
-        self.app = web.Application()
-        self.setup_routes()
-        
-    def setup_routes(self):
-        self.app.router.add_get('/', self.handle_index)
-        self.app.router.add_get('/webapp', self.handle_webapp)
-        self.app.router.add_post('/api/get_balance', self.handle_get_balance)
-        self.app.router.add_post('/api/get_transactions', self.handle_get_transactions)
-        self.app.router.add_post('/api/transfer', self.handle_transfer)
-        self.app.router.add_static('/static', 'mini_app')
-    
-    async def verify_telegram_init_data(self, init_data: str):
-        """Проверка подлинности данных от Telegram"""
-        try:
-            parsed_data = dict(
-                param.split("=") 
-                for param in init_data.split("&") 
-                if "=" in param
-            )
-            
-            hash_str = parsed_data.pop("hash", "")
-            data_check_string = "\n".join(
-                f"{key}={value}" 
-                for key, value in sorted(parsed_data.items())
-            )
-            
-            secret_key = hmac.new(
-                b"WebAppData", 
-                BOT_TOKEN.encode(), 
-                hashlib.sha256
-            ).digest()
-            
-            calculated_hash = hmac.new(
-                secret_key, 
-                data_check_string.encode(), 
-                hashlib.sha256
-            ).hexdigest()
-            
-            return calculated_hash == hash_str
-        except:
-            return False
-    
-    async def handle_index(self, request):
-        return web.FileResponse('mini_app/index.html')
-    
-    async def handle_webapp(self, request):
-        return web.FileResponse('mini_app/index.html')
-    
-    async def handle_get_balance(self, request):
-        try:
-            data = await request.json()
-            init_data = request.headers.get('X-Telegram-Init-Data', '')
-            
-            if not await self.verify_telegram_init_data(init_data):
-                return web.json_response({'error': 'Invalid init data'}, status=401)
-            
-            # Извлекаем user_id из init_data
-            import urllib.parse
-            parsed = urllib.parse.parse_qs(init_data)
-            user_id = int(parsed.get('user', [{}])[0].get('id', 0))
-            
-            if not user_id:
-                return web.json_response({'error': 'User not found'}, status=400)
-            
-            async with AsyncSessionLocal() as session:
-                user = await session.get(User, user_id)
-                if not user:
-                    return web.json_response({'error': 'User not found'}, status=404)
-                
-                return web.json_response({
-                    'success': True,
-                    'balance': user.balance,
-                    'user': {
-                        'id': user.user_id,
-                        'username': user.username,
-                        'first_name': user.first_name
-                    }
-                })
-                
-        except Exception as e:
-            return web.json_response({'error': str(e)}, status=500)
-    
-    async def handle_get_transactions(self, request):
-        try:
-            data = await request.json()
-            init_data = request.headers.get('X-Telegram-Init-Data', '')
-            page = data.get('page', 1)
-            limit = data.get('limit', 20)
-            
-            if not await self.verify_telegram_init_data(init_data):
-                return web.json_response({'error': 'Invalid init data'}, status=401)
-            
-            # Извлекаем user_id из init_data
-            import urllib.parse
-            parsed = urllib.parse.parse_qs(init_data)
-            user_id = int(parsed.get('user', [{}])[0].get('id', 0))
-            
-            async with AsyncSessionLocal() as session:
-                offset = (page - 1) * limit
-                
-                # Получаем транзакции
-                result = await session.execute(
-                    select(Transaction).where(
-                        (Transaction.from_user_id == user_id) | 
-                        (Transaction.to_user_id == user_id)
-                    )
-                    .order_by(Transaction.created_at.desc())
-                    .offset(offset)
-                    .limit(limit)
-                )
-                
-                transactions = result.scalars().all()
-                
-                transaction_list = []
-                for t in transactions:
-                    # Определяем тип транзакции для пользователя
-                    if t.from_user_id == user_id and t.to_user_id != user_id:
-                        transaction_type = 'outgoing'
-                        amount_display = f"-{t.amount}"
-                    elif t.to_user_id == user_id and t.from_user_id != user_id:
-                        transaction_type = 'incoming'
-                        amount_display = f"+{t.amount}"
-                    else:
-                        transaction_type = 'system'
-                        amount_display = f"+{t.amount}"
-                    
-                    # Получаем информацию о втором участнике
-                    other_user_id = t.to_user_id if t.from_user_id == user_id else t.from_user_id
-                    other_user = await session.get(User, other_user_id) if other_user_id > 0 else None
-                    
-                    transaction_list.append({
-                        'id': t.id,
-                        'type': transaction_type,
-                        'amount': t.amount,
-                        'amount_display': amount_display,
-                        'description': t.description or '',
-                        'created_at': t.created_at.isoformat(),
-                        'other_user': {
-                            'id': other_user.user_id if other_user else 0,
-                            'username': other_user.username if other_user else 'Система',
-                            'first_name': other_user.first_name if other_user else 'Система'
-                        } if other_user else {
-                            'id': 0,
-                            'username': 'Система',
-                            'first_name': 'Система'
-                        }
-                    })
-                
-                return web.json_response({
-                    'success': True,
-                    'transactions': transaction_list,
-                    'page': page,
-                    'has_more': len(transactions) == limit
-                })
-                
-        except Exception as e:
-            return web.json_response({'error': str(e)}, status=500)
-    
-    async def handle_transfer(self, request):
-        try:
-            data = await request.json()
-            init_data = request.headers.get('X-Telegram-Init-Data', '')
-            
-            if not await self.verify_telegram_init_data(init_data):
-                return web.json_response({'error': 'Invalid init data'}, status=401)
-            
-            # Извлекаем user_id из init_data
-            import urllib.parse
-            parsed = urllib.parse.parse_qs(init_data)
-            user_id = int(parsed.get('user', [{}])[0].get('id', 0))
-            
-            recipient_input = data.get('recipient')
-            amount = int(data.get('amount', 0))
-            
-            if amount <= 0:
-                return web.json_response({'error': 'Invalid amount'}, status=400)
-            
-            async with AsyncSessionLocal() as session:
-                # Проверяем отправителя
-                sender = await session.get(User, user_id)
-                if not sender:
-                    return web.json_response({'error': 'Sender not found'}, status=404)
-                
-                if sender.balance < amount:
-                    return web.json_response({'error': 'Insufficient funds'}, status=400)
-                
-                # Ищем получателя
-                if recipient_input.isdigit():
-                    recipient = await session.get(User, int(recipient_input))
-                else:
-                    if recipient_input.startswith('@'):
-                        recipient_input = recipient_input[1:]
-                    result = await session.execute(
-                        select(User).where(User.username == recipient_input)
-                    )
-                    recipient = result.scalar_one_or_none()
-                
-                if not recipient:
-                    return web.json_response({'error': 'Recipient not found'}, status=404)
-                
-                if recipient.user_id == sender.user_id:
-                    return web.json_response({'error': 'Cannot transfer to yourself'}, status=400)
-                
-                # Выполняем перевод
-                sender.balance -= amount
-                recipient.balance += amount
-                
-                # Записываем транзакцию
-                transaction = Transaction(
-                    from_user_id=sender.user_id,
-                    to_user_id=recipient.user_id,
-                    amount=amount,
-                    type='transfer',
-                    description=f"Перевод через Mini App"
-                )
-                session.add(transaction)
-                
-                await session.commit()
-                
-                # Отправляем уведомление получателю
-                try:
-                    bot = request.app['bot']
-                    await bot.send_message(
-                        recipient.user_id,
-                        f"💰 Вы получили перевод через Mini App!\n"
-                        f"📥 Отправитель: {sender.first_name}\n"
-                        f"💵 Сумма: {amount}₽\n"
-                        f"💰 Ваш баланс: {recipient.balance}₽"
-                    )
-                except Exception as e:
-                    print(f"Failed to send notification: {e}")
-                
-                return web.json_response({
-                    'success': True,
-                    'new_balance': sender.balance,
-                    'recipient': {
-                        'id': recipient.user_id,
-                        'username': recipient.username,
-                        'first_name': recipient.first_name
-                    }
-                })
-                
-        except Exception as e:
-            return web.json_response({'error': str(e)}, status=500)
-    
-    async def start(self, bot):
-        """Запуск сервера с передачей экземпляра бота"""
-        self.app['bot'] = bot
-        runner = web.AppRunner(self.app)
-        await runner.setup()
-        site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
-        await site.start()
-        print(f"WebApp server started on http://{WEBAPP_HOST}:{WEBAPP_PORT}")
\ No newline at end of file
+from aiohttp import web
+import aiohttp
+from datetime import datetime, timedelta
+import csv
+import io
+import json
+import logging
+import sys
+import zlib
+from sqlalchemy import select, union, or_, and_, case
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+
+from database import AsyncSessionLocal
+from models import User, Transaction, SYSTEM_USER_ID
+from stats import user_stats
+from transfers import (transfer, TransferError, InvalidAmount, SelfTransfer,
+                       SenderNotFound, RecipientNotFound, InsufficientFunds)
+from config import (WEBAPP_HOST, WEBAPP_PORT, WORKERS, EXPORT_CHUNK_ROWS, EVENTS_KEEPALIVE, METRICS_ENABLED,
+                    RATE_LIMIT_QUEUE_TIMEOUT)
+from telegram_auth import InitDataVerifier
+from idempotency import IdempotencyCache, IdempotencyConflict
+from notifications import notifier
+from balance_cache import balance_cache
+from click_aggregator import click_aggregator
+from recipients import recipient_resolver
+from events import event_hub, format_event
+import metrics
+import rate_limit
+from assets import AssetBundle
+from leaderboard import leaderboard
+
+logger = logging.getLogger(__name__)
+
+# Системный пользователь (бонусы, клики) - в таблице users SQLite его нет
+SYSTEM_USER = {
+    'id': SYSTEM_USER_ID,
+    'username': 'Система',
+    'first_name': 'Система'
+}
+
+# Ошибки перевода -> ответ API
+TRANSFER_ERRORS = {
+    InvalidAmount: ('Invalid amount', 400),
+    SelfTransfer: ('Cannot transfer to yourself', 400),
+    SenderNotFound: ('Sender not found', 404),
+    RecipientNotFound: ('Recipient not found', 404),
+    InsufficientFunds: ('Insufficient funds', 400),
+}
+
+# Больше операций в одном /api/batch не принимаем
+BATCH_MAX_REQUESTS = 10
+
+# Форматы выгрузки истории: расширение -> Content-Type
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+EXPORT_COLUMNS = ('id', 'created_at', 'direction', 'type', 'amount', 'other_user_id',
+                  'other_username', 'other_first_name', 'description')
+
+
+class RedactedAccessLogger(web.AccessLogger):
+    """Журнал доступа без initData: /api/events получает подпись Telegram в строке запроса"""
+    
+    def log(self, request, response, time):
+        if request is not None and 'initData' in request.query:
+            request = request.clone(rel_url=request.rel_url.without_query_params('initData'))
+        super().log(request, response, time)
+
+
+def transaction_direction(from_user_id: int, to_user_id: int, user_id: int):
+    """Направление транзакции для пользователя: outgoing, incoming или system"""
+    if from_user_id == user_id and to_user_id != user_id:
+        return 'outgoing'
+    if to_user_id == user_id and from_user_id != user_id:
+        return 'incoming'
+    return 'system'
+
+
+def parse_limit(value, default: int, maximum: int):
+    """Размер страницы из запроса в пределах 1..maximum; None - не число"""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return None
+    return max(1, min(limit, maximum))
+
+
+def parse_cursor(before_id, before_created_at):
+    """Курсор истории из next_cursor: (id, created_at) или (None, None) для первой страницы.
+
+    ValueError/TypeError - курсор неполный или испорчен.
+    """
+    if before_id is None and before_created_at is None:
+        return None, None
+    if before_id is None or before_created_at is None:
+        raise ValueError("before_id и before_created_at передаются вместе")
+    return int(before_id), datetime.fromisoformat(before_created_at)
+
+
+def parse_export_date(value, end=False):
+    """'2024-05-01' или ISO-время; дата в конце диапазона включает весь день"""
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        moment += timedelta(days=1)
+    return moment
+
+
+class WebAppServer:
+    def __init__(self):
+        self.init_data_verifier = InitDataVerifier()
+        self.idempotency = IdempotencyCache()
+        # Лимиты частоты - после проверки initData, когда пользователь уже известен
+        middlewares = [self.auth_middleware, rate_limit.http_middleware]
+        if METRICS_ENABLED:
+            # Первым: время запроса вместе с проверкой initData
+            middlewares.insert(0, metrics.http_middleware)
+        self.app = web.Application(middlewares=middlewares)
+        self.runner = None
+        # Файлы Mini App: хэши, сжатые варианты и index.html с новыми именами - один раз при запуске
+        self.assets = AssetBundle('mini_app').build()
+        # Операции чтения, доступные через /api/batch: имя -> (session, user_id, params) -> (тело, статус)
+        self.batch_methods = {
+            'get_balance': self.read_balance,
+            'get_transactions': self.read_transactions,
+            'leaderboard': self.read_leaderboard,
+        }
+        self.setup_routes()
+        
+    def setup_routes(self):
+        self.app.router.add_get('/', self.handle_index)
+        self.app.router.add_get('/webapp', self.handle_webapp)
+        self.app.router.add_post('/api/get_balance', self.handle_get_balance)
+        self.app.router.add_post('/api/get_transactions', self.handle_get_transactions)
+        self.app.router.add_post('/api/transfer', self.handle_transfer)
+        self.app.router.add_post('/api/search_users', self.handle_search_users)
+        self.app.router.add_post('/api/batch', self.handle_batch)
+        self.app.router.add_post('/api/leaderboard', self.handle_leaderboard)
+        self.app.router.add_get('/api/export', self.handle_export)
+        self.app.router.add_get('/api/events', self.handle_events)
+        self.app.router.add_get('/static/{name}', self.handle_static)
+        if METRICS_ENABLED:
+            self.app.router.add_get('/metrics', metrics.handle_metrics)
+    
+    @web.middleware
+    async def auth_middleware(self, request, handler):
+        """Проверяет initData один раз на запрос и кладёт пользователя в request"""
+        if request.path.startswith('/api/'):
+            init_data = request.headers.get('X-Telegram-Init-Data', '')
+            if not init_data and request.path == '/api/events':
+                # EventSource не умеет передавать заголовки
+                init_data = request.query.get('initData', '')
+            identity = self.init_data_verifier.verify(init_data)
+            if identity is None:
+                return web.json_response({'error': 'Invalid init data'}, status=401)
+            
+            request['user_id'] = identity['user_id']
+            request['tg_user'] = identity['user']
+        
+        return await handler(request)
+    
+    async def handle_index(self, request):
+        return self.assets.response(request, self.assets.index)
+    
+    async def handle_webapp(self, request):
+        return self.assets.response(request, self.assets.index)
+    
+    async def handle_static(self, request):
+        asset = self.assets.assets.get(request.match_info['name'])
+        if asset is None:
+            raise web.HTTPNotFound()
+        return self.assets.response(request, asset)
+    
+    async def handle_get_balance(self, request):
+        try:
+            data = await request.json()
+            
+            # Пользователь уже проверен в auth_middleware
+            async with AsyncSessionLocal() as session:
+                body, status = await self.read_balance(session, request['user_id'], data)
+            return web.json_response(body, status=status)
+                
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def handle_get_transactions(self, request):
+        try:
+            data = await request.json()
+            
+            # Пользователь уже проверен в auth_middleware
+            async with AsyncSessionLocal() as session:
+                body, status = await self.read_transactions(session, request['user_id'], data)
+            return web.json_response(body, status=status)
+                
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def handle_leaderboard(self, request):
+        try:
+            data = await request.json()
+            
+            async with AsyncSessionLocal() as session:
+                body, status = await self.read_leaderboard(session, request['user_id'], data)
+            return web.json_response(body, status=status)
+        
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def handle_batch(self, request):
+        """Несколько операций чтения за один запрос: одна проверка initData и одна сессия БД.
+        
+        {"requests": [{"method": "get_balance"}, {"method": "get_transactions", "params": {...}}]}
+        -> {"success": true, "results": [ответ get_balance, ответ get_transactions]}
+        """
+        try:
+            try:
+                data = await request.json()
+            except json.JSONDecodeError:
+                return web.json_response({'error': 'Invalid JSON'}, status=400)
+            # Список операций без обёртки {"requests": ...} - тоже ошибка клиента, а не 500
+            operations = data.get('requests') if isinstance(data, dict) else None
+            if not isinstance(operations, list) or not 0 < len(operations) <= BATCH_MAX_REQUESTS:
+                return web.json_response({'error': 'Invalid requests'}, status=400)
+            
+            user_id = request['user_id']
+            results = []
+            async with AsyncSessionLocal() as session:
+                for operation in operations:
+                    params = (operation.get('params') or {}) if isinstance(operation, dict) else None
+                    if not isinstance(params, dict):
+                        results.append({'error': 'Invalid request', 'status': 400})
+                        continue
+                    method_name = operation.get('method')
+                    method = self.batch_methods.get(method_name) if isinstance(method_name, str) else None
+                    if method is None:
+                        results.append({'error': 'Unknown method', 'status': 400})
+                        continue
+                    try:
+                        body, status = await method(session, user_id, params)
+                    except Exception as e:
+                        # Ошибка одной операции не отменяет остальные
+                        body, status = {'error': str(e)}, 500
+                    results.append(dict(body, status=status))
+            
+            return web.json_response({'success': True, 'results': results})
+        
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def read_balance(self, session: AsyncSession, user_id: int, data):
+        """Баланс и статистика пользователя, возвращает (тело ответа, HTTP-статус)"""
+        if not user_id:
+            return {'error': 'User not found'}, 400
+        
+        user = await balance_cache.load(session, user_id)
+        if not user:
+            return {'error': 'User not found'}, 404
+        
+        # Как и в хэндлерах бота: клики, ещё не записанные в БД, уже в балансе
+        return {
+            'success': True,
+            'balance': user.balance + click_aggregator.pending_amount(user_id),
+            'user': {
+                'id': user.user_id,
+                'username': user.username,
+                'first_name': user.first_name
+            },
+            'stats': user_stats(user)
+        }, 200
+    
+    async def read_leaderboard(self, session: AsyncSession, user_id: int, data):
+        """Первые места и место пользователя, возвращает (тело ответа, HTTP-статус)"""
+        limit = parse_limit(data.get('limit'), 10, 100)
+        if limit is None:
+            return {'error': 'Invalid limit'}, 400
+        rank = leaderboard.rank(user_id)
+        return {
+            'success': True,
+            'top': await leaderboard.entries(session, limit),
+            'me': {'rank': rank, 'balance': leaderboard.balance(user_id)} if rank is not None else None,
+            'total': len(leaderboard)
+        }, 200
+    
+    async def read_transactions(self, session: AsyncSession, user_id: int, data):
+        """Страница истории, возвращает (тело ответа, HTTP-статус)"""
+        limit = parse_limit(data.get('limit'), 20, 100)
+        if limit is None:
+            return {'error': 'Invalid limit'}, 400
+        if 'page' in data:
+            # Постраничный режим через OFFSET (для совместимости)
+            page = parse_limit(data['page'], 1, sys.maxsize)
+            if page is None:
+                return {'error': 'Invalid page'}, 400
+            result = await self.get_transactions_page(session, user_id, page, limit)
+        else:
+            # Курсорный режим: before_id/before_created_at из next_cursor
+            try:
+                before_id, before_created_at = parse_cursor(data.get('before_id'), data.get('before_created_at'))
+            except (TypeError, ValueError):
+                return {'error': 'Invalid cursor'}, 400
+            result = await self.get_transactions_before(
+                session, user_id, limit,
+                before_id=before_id,
+                before_created_at=before_created_at
+            )
+        return result, 200
+    
+    async def load_counterparties(self, session: AsyncSession, user_ids):
+        """Загружает участников переводов одним запросом: {user_id: данные}"""
+        counterparties = {SYSTEM_USER_ID: SYSTEM_USER}
+        
+        # Системного пользователя в таблице нет, его в БД не ищем
+        ids = set(user_ids) - {SYSTEM_USER_ID}
+        if ids:
+            result = await session.execute(
+                select(User.user_id, User.username, User.first_name)
+                .where(User.user_id.in_(ids))
+            )
+            for user_id, username, first_name in result:
+                counterparties[user_id] = {
+                    'id': user_id,
+                    'username': username,
+                    'first_name': first_name
+                }
+        
+        return counterparties
+    
+    async def get_transactions_page(self, session: AsyncSession, user_id: int, page: int, limit: int):
+        """Страница истории через OFFSET: ровно два запроса при любом размере страницы"""
+        offset = (page - 1) * limit
+        
+        # Получаем транзакции
+        result = await session.execute(
+            select(Transaction).where(
+                (Transaction.from_user_id == user_id) | 
+                (Transaction.to_user_id == user_id)
+            )
+            .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+            .offset(offset)
+            .limit(limit)
+        )
+        
+        transactions = result.scalars().all()
+        
+        return {
+            'success': True,
+            'transactions': await self.serialize_transactions(session, user_id, transactions),
+            'page': page,
+            'has_more': len(transactions) == limit,
+            'next_cursor': self.make_cursor(transactions[-1]) if transactions else None
+        }
+    
+    async def get_transactions_before(self, session: AsyncSession, user_id: int, limit: int,
+                                      before_id=None, before_created_at=None):
+        """Страница истории по курсору (created_at, id), без сканирования пропущенных строк"""
+        
+        def branch(column):
+            # Каждая ветка читает свой индекс (*_user_id, created_at, id) с нужного места
+            query = select(Transaction.id, Transaction.created_at).where(column == user_id)
+            if before_id is not None and before_created_at is not None:
+                query = query.where(or_(
+                    Transaction.created_at < before_created_at,
+                    and_(Transaction.created_at == before_created_at, Transaction.id < before_id)
+                ))
+            return select(
+                query.order_by(Transaction.created_at.desc(), Transaction.id.desc())
+                .limit(limit + 1)
+                .subquery()
+            )
+        
+        # OR по двум колонкам не использует индексы, поэтому UNION двух веток
+        page_ids = union(
+            branch(Transaction.from_user_id),
+            branch(Transaction.to_user_id)
+        ).subquery()
+        
+        result = await session.execute(
+            select(Transaction)
+            .join(page_ids, Transaction.id == page_ids.c.id)
+            .order_by(Transaction.created_at.desc(), Transaction.id.desc())
+            .limit(limit + 1)
+        )
+        
+        transactions = result.scalars().all()
+        has_more = len(transactions) > limit
+        transactions = transactions[:limit]
+        
+        return {
+            'success': True,
+            'transactions': await self.serialize_transactions(session, user_id, transactions),
+            'has_more': has_more,
+            'next_cursor': self.make_cursor(transactions[-1]) if has_more else None
+        }
+    
+    def make_cursor(self, transaction):
+        return {
+            'before_id': transaction.id,
+            'before_created_at': transaction.created_at.isoformat()
+        }
+    
+    async def serialize_transactions(self, session: AsyncSession, user_id: int, transactions):
+        # Получаем информацию о вторых участниках всей страницы сразу
+        other_user_ids = [
+            t.to_user_id if t.from_user_id == user_id else t.from_user_id
+            for t in transactions
+        ]
+        counterparties = await self.load_counterparties(session, other_user_ids)
+        
+        transaction_list = []
+        for t, other_user_id in zip(transactions, other_user_ids):
+            # Определяем тип транзакции для пользователя
+            transaction_type = transaction_direction(t.from_user_id, t.to_user_id, user_id)
+            sign = '-' if transaction_type == 'outgoing' else '+'
+            amount_display = f"{sign}{t.amount}"
+            
+            transaction_list.append({
+                'id': t.id,
+                'type': transaction_type,
+                'amount': t.amount,
+                'amount_display': amount_display,
+                'description': t.description or '',
+                'created_at': t.created_at.isoformat(),
+                'other_user': counterparties.get(other_user_id, SYSTEM_USER)
+            })
+        
+        return transaction_list
+    
+    async def handle_transfer(self, request):
+        try:
+            data = await request.json()
+            
+            # Пользователь уже проверен в auth_middleware
+            user_id = request['user_id']
+            
+            recipient_input = str(data.get('recipient') or '')
+            amount = int(data.get('amount', 0))
+            
+            idempotency_key = request.headers.get('Idempotency-Key')
+            if idempotency_key is None:
+                body, status = await self.perform_transfer(request, user_id, recipient_input, amount)
+                return web.json_response(body, status=status)
+            
+            if not idempotency_key or len(idempotency_key) > 64:
+                return web.json_response({'error': 'Invalid Idempotency-Key'}, status=400)
+            
+            # Повтор с тем же ключом получает сохранённый ответ, а не второй перевод
+            try:
+                body, status = await self.idempotency.run(
+                    (user_id, idempotency_key),
+                    (recipient_input, amount),
+                    lambda: self.perform_transfer(request, user_id, recipient_input, amount, idempotency_key),
+                    cacheable=lambda result: result[1] < 500
+                )
+            except IdempotencyConflict:
+                return web.json_response({'error': 'Idempotency-Key reused with different parameters'}, status=422)
+            
+            return web.json_response(body, status=status)
+                
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def handle_search_users(self, request):
+        """Автодополнение получателя по началу username"""
+        try:
+            data = await request.json()
+            query = str(data.get('query') or '')
+            limit = parse_limit(data.get('limit'), 10, 20)
+            if limit is None:
+                return web.json_response({'error': 'Invalid limit'}, status=400)
+            
+            async with AsyncSessionLocal() as session:
+                found = await recipient_resolver.search(session, query, limit, exclude=request['user_id'])
+            
+            return web.json_response({
+                'success': True,
+                'users': [
+                    {'id': user.user_id, 'username': user.username, 'first_name': user.first_name}
+                    for user in found
+                ]
+            })
+        
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def handle_export(self, request):
+        """Выгрузка истории в CSV или NDJSON потоком: ?format=csv|ndjson&from=&to=&gzip=1"""
+        user_id = request['user_id']
+        export_format = request.query.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return web.json_response({'error': 'Invalid format'}, status=400)
+        try:
+            since = parse_export_date(request.query.get('from'))
+            until = parse_export_date(request.query.get('to'), end=True)
+        except ValueError:
+            return web.json_response({'error': 'Invalid date'}, status=400)
+        compress = request.query.get('gzip') in ('1', 'true')
+        
+        
+        async def read_chunk(after=None, timeout=None):
+            """Порция строк в своей короткой сессии; None - не дождались места в лимите.
+
+            Место и соединение держим только на время запроса: пока медленный
+            клиент забирает ответ, они свободны для бота и остальных запросов.
+            """
+            if not await rate_limit.rate_limiter.acquire(timeout):
+                return None
+            try:
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        self.export_query(user_id, since, until, after, EXPORT_CHUNK_ROWS)
+                    )
+                    return result.all()
+            finally:
+                rate_limit.rate_limiter.release()
+        
+        # Первая порция - до заголовков, пока ещё можно ответить 503
+        rows = await read_chunk(timeout=RATE_LIMIT_QUEUE_TIMEOUT)
+        if rows is None:
+            return web.json_response({'error': 'Server is busy'}, status=503, headers={'Retry-After': '1'})
+        
+        filename = f"statement_{user_id}.{export_format}" + ('.gz' if compress else '')
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/gzip' if compress else EXPORT_FORMATS[export_format],
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'Cache-Control': 'no-store'
+        })
+        
+        # Заголовки уже отправлены: ошибка дальше обрывает ответ, и клиент видит неполный файл
+        compressor = zlib.compressobj(wbits=31) if compress else None  # 31 - формат gzip
+        
+        async def write(text: str):
+            data = text.encode('utf-8')
+            if compressor is not None:
+                # Сжатие порции - в потоке, чтобы большие выгрузки не держали цикл событий
+                data = await asyncio.to_thread(compressor.compress, data)
+            if data:
+                # write ждёт, пока клиент заберёт данные: в памяти не больше порции
+                await response.write(data)
+        
+        try:
+            await response.prepare(request)
+            if export_format == 'csv':
+                # BOM - чтобы Excel открыл кириллицу в UTF-8
+                await write('\ufeff' + ','.join(EXPORT_COLUMNS) + '\r\n')
+            
+            while rows:
+                records = [self.export_record(user_id, row) for row in rows]
+                if export_format == 'csv':
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(
+                        [record[column] for column in EXPORT_COLUMNS] for record in records
+                    )
+                    await write(buffer.getvalue())
+                else:
+                    await write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+                if len(rows) < EXPORT_CHUNK_ROWS:
+                    break
+                # Ключ (created_at, id) последней строки: следующая порция начинается сразу за ней
+                rows = await read_chunk(after=(rows[-1].created_at, rows[-1].id))
+            
+            if compressor is not None:
+                await response.write(compressor.flush())
+            await response.write_eof()
+        except ConnectionResetError:
+            logger.debug("Клиент ушёл, не дождавшись выгрузки пользователя %s", user_id)
+        except asyncio.CancelledError:
+            logger.debug("Выгрузка пользователя %s прервана", user_id)
+            raise
+        return response
+    
+    async def handle_events(self, request):
+        """Поток событий баланса и входящих переводов (Server-Sent Events).
+
+        initData проверяется один раз при подключении, дальше события
+        приходят из event_hub без обращений к БД.
+        """
+        user_id = request['user_id']
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # nginx не должен копить поток
+        })
+        await response.prepare(request)
+        
+        queue = event_hub.subscribe(user_id)
+        try:
+            # Подписка раньше чтения: баланс, записанный между ними, придёт событием
+            async with AsyncSessionLocal() as session:
+                user = await balance_cache.load(session, user_id)
+            await response.write(b"retry: 3000\n\n")
+            if user:
+                await response.write(format_event(self.with_pending_clicks(
+                    user_id, {'type': 'balance', 'data': {'balance': user.balance}}
+                )))
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Запись в закрытое соединение падает - так узнаём об ушедшем клиенте
+                    await response.write(b": ping\n\n")
+                    continue
+                if event is None:
+                    break
+                await response.write(format_event(self.with_pending_clicks(user_id, event)))
+        except ConnectionResetError:
+            pass
+        finally:
+            event_hub.unsubscribe(user_id, queue)
+        
+        return response
+    
+    def with_pending_clicks(self, user_id: int, event: dict):
+        """Баланс в событии - из БД; как и get_balance, добавляем клики, ещё не записанные в БД.
+
+        Считаем в момент отправки: к этому времени записанные клики уже в балансе события.
+        """
+        if 'balance' not in event['data']:
+            return event
+        # data события общая для всех вкладок пользователя - меняем копию
+        balance = event['data']['balance'] + click_aggregator.pending_amount(user_id)
+        return {'type': event['type'], 'data': dict(event['data'], balance=balance)}
+    
+    def export_query(self, user_id: int, since=None, until=None, after=None, limit=None):
+        """История пользователя по возрастанию вместе с данными второго участника.
+
+        after - ключ (created_at, id) последней отданной строки, limit - размер порции.
+        """
+        
+        def branch(column):
+            query = select(Transaction.id, Transaction.created_at).where(column == user_id)
+            if since is not None:
+                query = query.where(Transaction.created_at >= since)
+            if until is not None:
+                query = query.where(Transaction.created_at < until)
+            if after is not None:
+                after_created_at, after_id = after
+                query = query.where(or_(
+                    Transaction.created_at > after_created_at,
+                    and_(Transaction.created_at == after_created_at, Transaction.id > after_id)
+                ))
+            if limit is not None:
+                query = select(
+                    query.order_by(Transaction.created_at, Transaction.id).limit(limit).subquery()
+                )
+            return query
+        
+        # Как и в get_transactions_before: две ветки по индексам вместо OR
+        ids = union(branch(Transaction.from_user_id), branch(Transaction.to_user_id)).subquery()
+        other_user_id = case(
+            (Transaction.from_user_id == user_id, Transaction.to_user_id),
+            else_=Transaction.from_user_id
+        )
+        return (
+            select(Transaction.id, Transaction.created_at, Transaction.from_user_id,
+                   Transaction.to_user_id, Transaction.amount, Transaction.type,
+                   Transaction.description, other_user_id, User.username, User.first_name)
+            .join(ids, Transaction.id == ids.c.id)
+            .outerjoin(User, User.user_id == other_user_id)
+            .order_by(Transaction.created_at, Transaction.id)
+            .limit(limit)
+        )
+    
+    def export_record(self, user_id: int, row):
+        (transaction_id, created_at, from_user_id, to_user_id, amount, transaction_type,
+         description, other_user_id, username, first_name) = row
+        direction = transaction_direction(from_user_id, to_user_id, user_id)
+        if other_user_id == SYSTEM_USER_ID:
+            username, first_name = SYSTEM_USER['username'], SYSTEM_USER['first_name']
+        return {
+            'id': transaction_id,
+            'created_at': created_at.isoformat(),
+            'direction': direction,
+            'type': transaction_type,
+            'amount': -amount if direction == 'outgoing' else amount,
+            'other_user_id': other_user_id,
+            'other_username': username or '',
+            'other_first_name': first_name or '',
+            'description': description or ''
+        }
+    
+    async def perform_transfer(self, request, user_id: int, recipient_input: str, amount: int,
+                               idempotency_key=None):
+        """Перевод из Mini App, возвращает (тело ответа, HTTP-статус)"""
+        if amount <= 0:
+            return {'error': 'Invalid amount'}, 400
+        
+        async with AsyncSessionLocal() as session:
+            # Ищем получателя (@username без учёта регистра или user_id)
+            recipient = await recipient_resolver.resolve(session, recipient_input)
+        
+        if not recipient:
+            return {'error': 'Recipient not found'}, 404
+        
+        # Выполняем перевод одной атомарной транзакцией
+        try:
+            result = await transfer(
+                user_id,
+                recipient.user_id,
+                amount,
+                description="Перевод через Mini App",
+                idempotency_key=idempotency_key
+            )
+        except TransferError as e:
+            error, status = TRANSFER_ERRORS.get(type(e), (str(e), 400))
+            return {'error': error}, status
+        except IdempotencyConflict:
+            return {'error': 'Idempotency-Key reused with different parameters'}, 422
+        
+        # Уведомляем получателя через очередь (повтор уже выполненного перевода не уведомляет)
+        if not result.replayed:
+            notifier.send(
+                recipient.user_id,
+                f"💰 Вы получили перевод через Mini App!\n"
+                f"📥 Отправитель: {request['tg_user'].get('first_name')}\n"
+                f"💵 Сумма: {amount}₽\n"
+                f"💰 Ваш баланс: {result.recipient_balance}₽"
+            )
+        
+        return {
+            'success': True,
+            'new_balance': result.sender_balance + click_aggregator.pending_amount(user_id),
+            'transaction_id': result.transaction_id,
+            'recipient': {
+                'id': recipient.user_id,
+                'username': recipient.username,
+                'first_name': recipient.first_name
+            }
+        }, 200
+    
+    async def start(self, bot):
+        """Запуск сервера с передачей экземпляра бота"""
+        self.app['bot'] = bot
+        self.runner = web.AppRunner(self.app, access_log_class=RedactedAccessLogger)
+        await self.runner.setup()
+        # Несколько воркеров слушают один порт, ядро распределяет соединения между ними
+        site = web.TCPSite(self.runner, WEBAPP_HOST, WEBAPP_PORT, reuse_port=WORKERS > 1)
+        await site.start()
+        print(f"WebApp server started on http://{WEBAPP_HOST}:{WEBAPP_PORT}")
+    
+    async def stop(self):
+        """Останавливает сервер; в режиме вебхука дожидается апдейтов в обработке"""
+        if self.runner is not None:
+            # Открытые потоки событий иначе держали бы остановку до таймаута
+            event_hub.close()
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import secrets
+
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_INFLIGHT,
+                    WEBHOOK_MAX_CONNECTIONS)
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Приём апдейтов вебхуком с ограничением числа обрабатываемых одновременно.
+
+    Telegram сразу получает 200, апдейт обрабатывается в фоне. Когда
+    в обработке уже max_inflight апдейтов, ответ задерживается до
+    освобождения места - Telegram сам притормаживает отправку.
+    """
+
+    def __init__(self, dispatcher, bot, max_inflight=WEBHOOK_MAX_INFLIGHT, **kwargs):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._slots = asyncio.Semaphore(max_inflight)
+        self.processed = 0
+
+    def __len__(self):
+        return len(self._background_feed_update_tasks)
+
+    def verify_secret(self, telegram_secret_token: str, bot) -> bool:
+        # В отличие от SimpleRequestHandler, без секрета не принимаем ничего
+        return bool(self.secret_token) and secrets.compare_digest(telegram_secret_token, self.secret_token)
+
+    async def _background_feed_update(self, bot, update):
+        try:
+            await super()._background_feed_update(bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки апдейта %s", update.get('update_id'))
+        finally:
+            self.processed += 1
+            self._slots.release()
+
+    async def _handle_request_background(self, bot, request):
+        await self._slots.acquire()
+        try:
+            return await super()._handle_request_background(bot, request)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def close(self):
+        """Дожидается апдейтов в обработке; сессию бота закрывает main"""
+        if self._background_feed_update_tasks:
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+
+
+def setup_webhook(app, dispatcher, bot):
+    """Вешает приём апдейтов на приложение aiohttp сервера Mini App"""
+    if not WEBHOOK_SECRET:
+        # Иначе любой, кто знает адрес, пришлёт апдейт от чужого имени и переведёт чужие деньги
+        raise RuntimeError("Режим вебхука требует WEBHOOK_SECRET (1-256 символов A-Z, a-z, 0-9, _ и -)")
+    handler = LimitedRequestHandler(dispatcher, bot, secret_token=WEBHOOK_SECRET)
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+    return handler
+
+
+async def set_webhook(bot, dispatcher):
+    url = f"{WEBHOOK_HOST.rstrip('/')}{WEBHOOK_PATH}"
+    await bot.set_webhook(
+        url,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dispatcher.resolve_used_update_types()
+    )
+    logger.info("Вебхук установлен: %s", url)